@@ -27,7 +27,7 @@ from .model import ColumnType, BasicColumnType, TypeAdapter, Model, Table, \
 	Column, CheckConstraint, PrimaryKeyConstraint, NotNullConstraint, \
 	UniquenessConstraint, RegexConstraint, Session, Unique, RangeConstraint, \
 	type_adapter, model, create_session, initialize_model, dictized_property, \
-	dictize, update_column_types, relational_property, _sentinel
+	dictize, update_column_types, relational_property, prefetch, Index, _sentinel
 
 #	Create a logger.
 log = logger(__name__)
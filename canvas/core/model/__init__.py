@@ -13,7 +13,11 @@ Note: Within this package's documentation, 'serialize' is equivalent to
 _sentinel = object()
 
 #	TODO: Review this import practice.
-from .statements import CreateStatement
+from ...configuration import config
+from .statements import CreateStatement, statement_cache
+from .result_cache import get_result_cache
+from .invalidation import invalidation_config, create_versions_table, \
+	add_invalidation_callback
 from .ast import Unique
 from .type_adapters import TypeAdapter, type_adapter
 from .model import Model, model
@@ -22,9 +26,10 @@ from .columns import ColumnType, BasicColumnType, Column, update_column_types
 from .constraints import CheckConstraint, PrimaryKeyConstraint, \
 	ForeignKeyConstraint, NotNullConstraint, UniquenessConstraint, \
 	RegexConstraint, RangeConstraint
+from .indexes import Index
 from .session import Session, create_session
 from .dictizations import dictized_property, dictize
-from .relationalism import relational_property
+from .relationalism import relational_property, prefetch
 
 def initialize_model():
 	'''
@@ -41,8 +46,20 @@ def initialize_model():
 		for column in table.columns.values():
 			column.post_bind()
 	
+	index_foreign_keys = config.database.get('index_foreign_keys', False)
 	for table in Table.topo_order():
 		#	Create table.
 		session.execute_statement(CreateStatement(table))
+		
+		#	Create indexes.
+		indexes = list(table.indexes)
+		if index_foreign_keys:
+			indexes.extend(table.foreign_key_indexes())
+		for index in indexes:
+			session.execute_statement(CreateStatement(index))
+
+	if invalidation_config()['mode'] == 'poll':
+		#	Create the version table polled for invalidations.
+		create_versions_table(session.cursor)
 	
 	session.commit()
@@ -6,6 +6,9 @@ methods. Contained interfaces are prefixed with I and mixins with M.
 
 from enum import Enum
 
+from ...exceptions import InvalidQuery
+from .type_adapters import ArrayParameter
+
 class Comparator(Enum):
 	'''The comparison operator enumerable.'''
 	EQUALS				= '='
@@ -57,6 +60,15 @@ class Node:
 		'''
 		raise NotImplementedError()
 
+	def shape(self, values):
+		'''
+		Return a hashable key that uniquely identifies the SQL `serialize` 
+		would produce for this node, appending values to `values` exactly as
+		`serialize` would. Nodes that can't be keyed return `None`, which 
+		prevents caching of the statement containing them.
+		'''
+		return None
+
 class ILiteral:
 	'''A flag interface that informs eager bracket usage.'''
 	pass
@@ -90,6 +102,14 @@ class ISelectable:
 		'''
 		return row_segment[0]
 
+	def create_loader(self):
+		'''
+		Return an object whose `load_next` method loads the rows of a single
+		execution of a selection of this node. Selectables that keep load 
+		state must return a new object, so that executions don't interfere.
+		'''
+		return self
+
 class IJoinable:
 	'''
 	An interface to be implemented by objects which can be join onto or can
@@ -226,6 +246,9 @@ class Literal(Node):
 		'''Return the SQL represented by this literal node.'''
 		return self.sql
 
+	def shape(self, values):
+		return ('literal', self.sql)
+
 class Value(Node, ILiteral, MAllTypes):
 	'''A node containing a real value to be sanitized or inserted.'''
 
@@ -245,6 +268,16 @@ class Value(Node, ILiteral, MAllTypes):
 		values.append(self.value)
 		return 'NOT %s' if self.inverted else '%s'
 
+	def shape(self, values):
+		'''Key null and boolean values, which are serialized inline.'''
+		if self.value is None:
+			return ('null', self.inverted)
+		if isinstance(self.value, bool):
+			return ('bool', self.inverted == self.value)
+		
+		values.append(self.value)
+		return ('value', self.inverted)
+
 class ObjectReference(Node, ISelectable):
 	'''
 	An `ObjectReference` serializes into a reference to an in-database object.
@@ -309,6 +342,19 @@ class Comparison(Node, MFlag):
 
 		return sql
 
+	def shape(self, values):
+		left = self.left.shape(values)
+		if left is None:
+			return None
+		right = self.right.shape(values)
+		if right is None:
+			return None
+		
+		return (
+			'comparison', self.comparator, self.inverted, self.is_grouped, 
+			left, right
+		)
+
 	@property
 	def grouped(self):
 		'''
@@ -318,24 +364,93 @@ class Comparison(Node, MFlag):
 		self.is_grouped = True
 		return self
 
+class AnyOf(Node, MFlag):
+	'''
+	A set membership test, serialized as a comparison with `ANY` of a single 
+	array parameter so that the SQL is independent of the number of options.
+	Inversion yields the `NOT` form.
+	'''
+
+	def __init__(self, left, options):
+		'''
+		::left The node whose value is tested.
+		::options An iterable of the values to test against.
+		'''
+		self.left, self.options = nodeify(left), list(options)
+
+	def cast(self):
+		'''Return the array type to which the options are cast, or `None`.'''
+		from .columns import Column
+
+		if isinstance(self.left, Column):
+			return '%s[]'%self.left.type.cast_type()
+		return None
+
+	def serialize(self, values=list(), name_policy=None):
+		'''Return the SQL serialization of this membership test.'''
+		from .columns import Column
+
+		if name_policy and isinstance(self.left, Column):
+			left = name_policy(self.left)
+		else:
+			left = self.left.serialize(values, name_policy=name_policy)
+		
+		#	Casting also types empty arrays.
+		cast = self.cast()
+		values.append(ArrayParameter(self.options))
+		sql = '%s = ANY(%s)'%(left, 'CAST(%%s AS %s)'%cast if cast else '%s')
+		if self.inverted:
+			sql = 'NOT %s'%sql
+		return '(%s)'%sql
+
+	def shape(self, values):
+		left = self.left.shape(values)
+		if left is None:
+			return None
+		values.append(ArrayParameter(self.options))
+		return ('any_of', self.inverted, left, self.cast())
+
 class Aggregation(Node, ISelectable, ILiteral, MNumerical):
 	'''A call to an in-database aggregator.'''
 
-	def __init__(self, producer, source):
+	def __init__(self, producer, source, name=None, distinct=False):
 		'''
 		Create an aggregation.
 		::producer The in-database name of the aggregator.
 		::source The source of the values to be aggregated (a column).
+		::name The name of this aggregation in dictized rows. Defaults to
+			<producer>_[distinct_]<column name>.
+		::distinct Whether to only aggregate distinct values.
 		'''
 		self.producer, self.source = producer, nodeify(source)
+		self.distinct = distinct
+		self.name = name or '_'.join((
+			producer.lower(), *(('distinct',) if distinct else tuple()),
+			self.source.name
+		))
+
+	@property
+	def asc(self):
+		return OrderItem(self, 'ASC')
+
+	@property
+	def desc(self):
+		return OrderItem(self, 'DESC')
 	
 	def serialize(self, values=list(), name_policy=None):
 		'''Serialize this aggregation as a call to an aggregator.'''
-		return '%s(%s)'%(
+		return '%s(%s%s)'%(
 			self.producer,
+			'DISTINCT ' if self.distinct else '',
 			self.source.serialize(values)
 		)
 
+	def shape(self, values):
+		source = self.source.shape(values)
+		if source is None:
+			return None
+		return ('aggregation', self.producer, self.distinct, source)
+
 	def serialize_selection(self, name_policy=None):
 		return self.serialize()
 
@@ -343,6 +458,93 @@ class Aggregation(Node, ISelectable, ILiteral, MNumerical):
 		'''Serialize the source of this aggregation (the column's table).'''
 		return self.source.table.serialize(values)
 
+class Projection(Node, ISelectable):
+	'''
+	A selection of an explicit list of columns or aggregations from a single
+	table, loaded as plain rows rather than models.
+	'''
+
+	def __init__(self, *items):
+		'''::items The columns or aggregations to select.'''
+		self.items = [deproxy(item) for item in items]
+		if not self.items:
+			raise InvalidQuery('Empty projection')
+		
+		#	Resolve the host table.
+		tables = set(self.item_table(item) for item in self.items)
+		if len(tables) != 1:
+			raise InvalidQuery('Projection spans multiple tables')
+		self.table = tables.pop()
+		#	The row dictization keys.
+		self.names = [item.name for item in self.items]
+
+	@classmethod
+	def item_table(cls, item):
+		'''Return the table from which `item` is selected.'''
+		return item.source.table if isinstance(item, Aggregation) else item.table
+
+	def shape(self, values):
+		parts = tuple(item.shape(values) for item in self.items)
+		if None in parts:
+			return None
+		return ('projection', parts)
+
+	def serialize_selection(self, name_policy=None):
+		return ', '.join(item.serialize_selection() for item in self.items)
+
+	def serialize_source(self, values=None):
+		return self.table.serialize_source(values)
+
+	def load_next(self, row_segment, session):
+		'''Return `row_segment` as a tuple.'''
+		return tuple(row_segment)
+
+	def load_dict(self, row_segment):
+		'''Return `row_segment` as a dictionary keyed by item name.'''
+		return dict(zip(self.names, row_segment))
+
+class Clause(Node):
+	'''A keyword-led clause of a statement containing a node.'''
+
+	def __init__(self, keyword, node):
+		'''
+		::keyword The SQL keyword that leads this clause.
+		::node The `Node` or nodeifiable contained by this clause.
+		'''
+		self.keyword, self.node = keyword, nodeify(node)
+	
+	def serialize(self, values=list(), name_policy=None):
+		'''Return the SQL serialization of this clause.'''
+		return ' '.join((
+			self.keyword, self.node.serialize(values, name_policy=name_policy)
+		))
+
+	def shape(self, values):
+		node = self.node.shape(values)
+		if node is None:
+			return None
+		return ('clause', self.keyword, node)
+
+class Group(Node, MFlag):
+	'''
+	A parenthesized `Node`, used to preserve the precedence of a condition
+	that's combined with another.
+	'''
+
+	def __init__(self, node):
+		'''::node The `Node` or nodeifiable to group.'''
+		self.node = nodeify(node)
+	
+	def serialize(self, values=list(), name_policy=None):
+		'''Return the SQL serialization of this group.'''
+		return '(%s)'%self.node.serialize(values, name_policy=name_policy)
+
+	def shape(self, values):
+		node = self.node.shape(values)
+		if node is None:
+			return None
+		return ('group', node)
+
 class Unique(Node, MFlag):
 	'''A call to the unique operator on a set of columns.'''
 
@@ -356,6 +558,74 @@ class Unique(Node, MFlag):
 			), ')'
 		))
 
+class Seek(Node, MFlag):
+	'''
+	A keyset pagination condition, which selects the rows that follow a set 
+	of order key values in an ordering. Orderings in a single direction are
+	serialized as a row comparison, which can be satisfied by an index scan.
+	'''
+
+	def __init__(self, order, keys):
+		'''
+		::order The `OrderItem`s of the ordering.
+		::keys The values of the ordered columns for the last row seen.
+		'''
+		if None in keys:
+			raise InvalidQuery('Null keyset pagination key')
+		self.order, self.keys = order, [Value(key) for key in keys]
+		self.uniform = len(set(item.which for item in order)) == 1
+
+	def key_sequence(self):
+		'''Return the key nodes in the order they're serialized.'''
+		if self.uniform:
+			return self.keys
+		return [key for i in range(len(self.keys)) for key in self.keys[:i + 1]]
+
+	def serialize(self, values=list(), name_policy=None):
+		'''Return the SQL serialization of this condition.'''
+		columns = [
+			name_policy(item.column) if name_policy else 
+				item.column.serialize() for item in self.order
+		]
+		comparors = ['>' if item.which == 'ASC' else '<' for item in self.order]
+		
+		if self.uniform:
+			sql = '(%s) %s (%s)'%(
+				', '.join(columns), comparors[0], 
+				', '.join(key.serialize(values) for key in self.keys)
+			)
+		else:
+			#	Expand into a disjunction of prefix equalities.
+			terms = list()
+			for i in range(len(columns)):
+				term = [
+					'%s = %s'%(column, key.serialize(values)) 
+						for column, key in zip(columns[:i], self.keys)
+				]
+				term.append('%s %s %s'%(
+					columns[i], comparors[i], self.keys[i].serialize(values)
+				))
+				terms.append('(%s)'%' AND '.join(term))
+			sql = '(%s)'%' OR '.join(terms)
+		
+		if self.inverted:
+			sql = 'NOT %s'%sql
+		return sql
+
+	def shape(self, values):
+		parts = list()
+		for key in self.key_sequence():
+			part = key.shape(values)
+			if part is None:
+				return None
+			parts.append(part)
+
+		return (
+			'seek', self.inverted, 
+			tuple((item.column.shape(values), item.which) for item in self.order),
+			tuple(parts)
+		)
+
 class OrderItem:
 
 	def __init__(self, column, which):
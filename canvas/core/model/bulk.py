@@ -0,0 +1,95 @@
+# coding: utf-8
+'''
+Bulk operation configuration and helpers for the insertion of models via 
+`COPY ... FROM STDIN`.
+'''
+
+import uuid
+
+from datetime import datetime, date, time
+
+from ...configuration import config
+from ...json_io import serialize_json
+
+#	The bulk operation configuration used when the `database.bulk` section is
+#	omitted.
+_default_bulk_config = {
+	'batch_size': 1000,
+	'copy_threshold': 10000,
+	'pipeline_size': 100
+}
+
+#	The Python types whose values can be written in COPY text format.
+_copyable_types = (
+	str, int, float, bool, datetime, date, time, dict, list, uuid.UUID
+)
+
+#	The COPY text format escape sequences.
+_copy_escapes = str.maketrans({
+	'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'
+})
+
+def bulk_config():
+	'''Return the effective bulk operation configuration.'''
+	bulk_config = dict(_default_bulk_config)
+	bulk_config.update(config.database.get('bulk', dict()))
+	return bulk_config
+
+def is_copyable(value):
+	'''Return whether `value` can be written in COPY text format.'''
+	return value is None or isinstance(value, _copyable_types)
+
+def copy_format(value):
+	'''Return `value` formatted as a COPY text format field.'''
+	if value is None:
+		return '\\N'
+	if isinstance(value, bool):
+		return 't' if value else 'f'
+	if isinstance(value, (dict, list)):
+		value = serialize_json(value)
+	elif isinstance(value, (datetime, date, time)):
+		value = value.isoformat()
+	elif isinstance(value, uuid.UUID):
+		#	Mirror the UUID type adapter.
+		value = value.hex
+	else:
+		value = str(value)
+	return value.translate(_copy_escapes)
+
+class CopyReader:
+	'''
+	A readable file-like object of rows in COPY text format. Rows are
+	formatted as they're read, so the payload is streamed to the server
+	rather than built in memory.
+	'''
+
+	def __init__(self, rows):
+		'''::rows An iterable of rows.'''
+		self.lines = (
+			'%s\n'%'\t'.join(copy_format(value) for value in row)
+				for row in rows
+		)
+		#	Data formatted beyond the end of the last read.
+		self.pending = ''
+
+	def read(self, size=-1):
+		'''Return up to `size` characters, or all remaining if negative.'''
+		if size is None or size < 0:
+			data, self.pending = self.pending + ''.join(self.lines), ''
+			return data
+
+		chunks, length = [self.pending], len(self.pending)
+		while length < size:
+			line = next(self.lines, None)
+			if line is None:
+				break
+			chunks.append(line)
+			length += len(line)
+
+		data = ''.join(chunks)
+		self.pending = data[size:]
+		return data[:size]
+
+def copy_buffer(rows):
+	'''Return a lazily formatted readable buffer of `rows` in COPY format.'''
+	return CopyReader(rows)
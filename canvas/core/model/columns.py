@@ -19,7 +19,7 @@ from ...exceptions import InvalidSchema, ValidationErrors, BadRequest
 from ...utils import logger
 from ..request_parsers import parse_datetime
 from .ast import Literal, ObjectReference, ILiteral, MAllTypes, Aggregation, \
-	OrderItem
+	OrderItem, AnyOf
 from .constraints import ForeignKeyConstraint, PrimaryKeyConstraint, \
 	NotNullConstraint, UniquenessConstraint
 from .tables import Table
@@ -35,9 +35,13 @@ _meta_null = object()
 class ColumnType:
 	'''The root column type class.'''
 
-	def __init__(self, lazy):
-		'''::lazy Whether this column type is lazy-loaded.'''
-		self.lazy = lazy
+	def __init__(self, lazy, generated=False):
+		'''
+		::lazy Whether this column type is lazy-loaded.
+		::generated Whether values are generated in-database when none is 
+			supplied.
+		'''
+		self.lazy, self.generated = lazy, generated
 		self.type = self.input_type = None
 
 	@classmethod
@@ -60,6 +64,10 @@ class ColumnType:
 	def describe(self):
 		'''Return an SQL serialization of this column type.'''
 		raise NotImplementedError()
+
+	def cast_type(self):
+		'''Return the SQL type to which values of this type can be cast.'''
+		return 'INTEGER' if self.type == 'SERIAL' else self.type
 	
 	def get_default(self):
 		'''
@@ -75,22 +83,25 @@ class BasicColumnType(ColumnType):
 	The trivial case of a column type. Instances are assumed to be singleton.
 	'''
 
-	def __init__(self, typ, input_type='text', default_policy=None, lazy=False):
+	def __init__(self, typ, input_type='text', default_policy=None, lazy=False,
+			generated=False):
 		'''
 		Create a new basic column type.
 		::typ The SQL type of this column.
 		::input_type The `<input/>` to use for this column type in forms.
 		::default_policy A callable yeilding a default value for this column.
 		::lazy Whether `Column`s of this type should be lazy-loaded.
+		::generated Whether values are generated in-database when none is 
+			supplied.
 		'''
-		super().__init__(lazy)
+		super().__init__(lazy, generated)
 		self.type, self.input_type = typ, input_type
 		self.default_policy = default_policy
 
 	def resolve_type(self, fmt):
 		if callable(self.type):
 			return BasicColumnType(self.type(fmt), self.input_type, 
-					self.default_policy, self.lazy)
+					self.default_policy, self.lazy, self.generated)
 		return self
 
 	def describe(self):
@@ -144,7 +155,7 @@ class ForeignKeyColumnType(ColumnType):
 _type_map = {
 	'int(?:eger)*': 	BasicColumnType('INTEGER', 'number'),
 	'real|float': 		BasicColumnType('REAL', 'number'),
-	'serial': 			BasicColumnType('SERIAL'),
+	'serial': 			BasicColumnType('SERIAL', generated=True),
 	'text': 			BasicColumnType('TEXT'),
 	'char\(([0-9]+)\)':	BasicColumnType(lambda fmt: 'CHAR(%s)'%fmt.group(1)),
 	'longtext': 		BasicColumnType('TEXT', 'textarea'),
@@ -203,10 +214,43 @@ class Column(ObjectReference, ILiteral, MAllTypes):
 		if unique and not contains_instance(UniquenessConstraint):
 			self.constraints.append(UniquenessConstraint())
 
+	def __get__(self, instance, owner=None):
+		'''
+		Columns are the class attributes of their models. As non-data 
+		descriptors, they're only invoked for instance access when the 
+		instance doesn't have a value for this column; loaded values are read
+		directly from the instance. In that case the value is lazy-loaded
+		from the database. The `ColumnSlot`s of compact models defer to this
+		for unset slots.
+		'''
+		if instance is None:
+			return self
+		session = instance.__session__
+		if not session:
+			return self
+		
+		primary_key = self.table.primary_key
+		value = session.query(
+			self, primary_key == primary_key.value_on(instance), one=True
+		)
+		#	Assign the loaded value without dirtying.
+		object.__setattr__(instance, self.name, value)
+		return value
+
 	def value_on(self, model):
 		'''Return the value on this column on `model`.'''
 		return getattr(model, self.name)
 
+	def insert_value_on(self, model):
+		'''
+		Return the value of this column to insert for `model`, or the sentinel
+		value if the in-database default should be used instead.
+		'''
+		value = getattr(model, self.name)
+		if value is None and self.type.generated:
+			return _sentinel
+		return value
+
 	def set_value_on(self, model, value):
 		'''Assign `value` to `model` on this column.'''
 		setattr(model, self.name, value)
@@ -251,6 +295,10 @@ class Column(ObjectReference, ILiteral, MAllTypes):
 		'''Serialize a reference to this column.'''
 		return '.'.join((self.table.name, self.name))
 
+	def shape(self, values):
+		'''Key this column by identity; columns live as long as the schema.'''
+		return ('column', id(self))
+
 	def serialize_selection(self):
 		return self.serialize()
 
@@ -275,15 +323,31 @@ class Column(ObjectReference, ILiteral, MAllTypes):
 		'''Return the `MIN` `Aggregation` of this column.'''
 		return Aggregation('MIN', self)
 
-	def count(self):
-		'''Return the `COUNT` `Aggregation` of this column.'''
-		return Aggregation('COUNT', self)
+	def count(self, distinct=False):
+		'''
+		Return the `COUNT` `Aggregation` of this column.
+		::distinct Whether to only count distinct values.
+		'''
+		return Aggregation('COUNT', self, distinct=distinct)
+
+	def sum(self):
+		'''Return the `SUM` `Aggregation` of this column.'''
+		return Aggregation('SUM', self)
+
+	def avg(self):
+		'''Return the `AVG` `Aggregation` of this column.'''
+		return Aggregation('AVG', self)
 	
+	def any_of(self, options):
+		'''
+		Return a test of whether the value of this column is one of `options`,
+		an iterable. Invert the result for the negative form.
+		'''
+		return AnyOf(self, options)
+
 	def is_one_of(self, *options):
-		query = False
-		for option in options:
-			query = (self == option) | query
-		return query.grouped
+		'''Return a test of whether the value of this column is in `options`.'''
+		return AnyOf(self, options)
 
 	#	TODO: Refactor and make extendable.
 	#	TODO: Use in apiutils.
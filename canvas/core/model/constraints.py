@@ -7,6 +7,16 @@ import re
 
 from ...exceptions import InvalidSchema
 from .ast import ObjectReference, Unique, MFlag, nodeify, reproxy
+from .type_adapters import ArrayParameter
+
+def describe_value(value):
+	'''
+	Return the literal serialization of `value` for a constraint description.
+	Array parameters are described as array constructors.
+	'''
+	if isinstance(value, ArrayParameter):
+		return 'ARRAY[%s]'%', '.join(describe_value(v) for v in value.values)
+	return "'%s'"%value
 
 class Constraint(ObjectReference):
 	'''
@@ -53,6 +63,19 @@ class Constraint(ObjectReference):
 		'''
 		raise NotImplementedError()
 
+	def prechecks(self):
+		'''Return whether this constraint implements prechecking.'''
+		return type(self).precheck_violation is not Constraint.precheck_violation
+
+	def precheck_violations(self, models, values):
+		'''
+		Return a list of flags indicating whether each of `values`, the values 
+		of `models`, violates this constraint. Overriding classes can check 
+		all values at once rather than invoking `precheck_violation` for each.
+		'''
+		check = self.precheck_violation
+		return [check(model, value) for model, value in zip(models, values)]
+
 	def validator_info(self):
 		'''
 		Return a dictionary containing a representation of this constraint that
@@ -114,7 +137,7 @@ class CheckConstraint(Constraint):
 		sql = condition.serialize(values)
 		if not isinstance(condition, Unique):
 			sql = ' '.join(('CHECK (', sql, ')'))
-		return sql%(*("'%s'"%v for v in values),)
+		return sql%(*(describe_value(v) for v in values),)
 
 class PrimaryKeyConstraint(Constraint):
 	'''A primary key constraint on a column.'''
@@ -147,6 +170,9 @@ class NotNullConstraint(Constraint):
 	def precheck_violation(self, model, value):
 		return value is None
 
+	def precheck_violations(self, models, values):
+		return [value is None for value in values]
+
 	def validator_info(self):
 		return None
 	
@@ -175,6 +201,16 @@ class RangeConstraint(Constraint):
 		return not ((self.max_value is None or value < self.max_value) and \
 			(self.min_value is None or value >= self.min_value))
 
+	def precheck_violations(self, models, values):
+		max_value, min_value = self.max_value, self.min_value
+		if max_value is None and min_value is None:
+			return [False]*len(values)
+		if max_value is None:
+			return [not value >= min_value for value in values]
+		if min_value is None:
+			return [not value < max_value for value in values]
+		return [not min_value <= value < max_value for value in values]
+
 	def describe_rule(self):
 		values = list()
 		rule = True
@@ -203,6 +239,13 @@ class RegexConstraint(Constraint):
 
 	def precheck_violation(self, model, value):
 		return (value is not None) and (bool(re.match(self.regex, value)) == self.invert)
+
+	def precheck_violations(self, models, values):
+		match, invert = re.compile(self.regex).match, self.invert
+		return [
+			value is not None and (match(value) is None) != invert 
+				for value in values
+		]
 	
 	def describe_rule(self):
 		opr = '~'
@@ -0,0 +1,66 @@
+# coding: utf-8
+'''
+The `IdentityMap` class definition. Sessions use an identity map to ensure
+each row is represented by at most one model instance.
+'''
+
+from weakref import WeakValueDictionary
+
+def identity_key(model):
+	'''Return the identity map key of `model`.'''
+	table = model.__class__.__table__
+	return (table, table.primary_key.value_on(model))
+
+class IdentityMap:
+	'''
+	A map of loaded models keyed by `(table, primary key value)` tuples. Clean
+	models are held weakly, so they're released once no longer referenced
+	elsewhere, while dirty models are held strongly until they're flushed.
+	'''
+
+	def __init__(self):
+		self.models = WeakValueDictionary()
+		self.dirty = dict()
+
+	def __len__(self):
+		return len(self.models)
+
+	def __contains__(self, key):
+		return key in self.models
+
+	def get(self, key):
+		'''Return the model tracked for `key`, or `None`.'''
+		return self.models.get(key)
+
+	def add(self, key, model):
+		'''Track the clean model `model` for `key`.'''
+		self.models[key] = model
+		self.dirty.pop(key, None)
+
+	def remove(self, key):
+		'''Stop tracking the model for `key`.'''
+		self.models.pop(key, None)
+		self.dirty.pop(key, None)
+
+	def mark_dirty(self, model):
+		'''Hold the tracked model `model` strongly until it's marked clean.'''
+		key = identity_key(model)
+		if key in self.models:
+			self.dirty[key] = model
+
+	def mark_clean(self, model):
+		'''Release the strong reference held to `model`, if any.'''
+		self.dirty.pop(identity_key(model), None)
+
+	def values(self):
+		'''Return a list of all tracked models.'''
+		return list(self.models.values())
+
+	def dirty_models(self):
+		'''Return a list of all strongly held models.'''
+		return list(self.dirty.values())
+
+	def clear(self):
+		'''Stop tracking all models.'''
+		self.models.clear()
+		self.dirty.clear()
@@ -0,0 +1,91 @@
+# coding: utf-8
+'''
+Index definitions. `Index`es are declared in the attribute map passed to the
+model decorator alongside columns and constraints, and are created after the
+tables of the schema.
+'''
+
+from ...exceptions import InvalidSchema
+from .ast import ObjectReference, MFlag, nodeify, deproxy
+
+class Index(ObjectReference):
+	'''An index on one or more columns or expressions of a table.'''
+
+	def __init__(self, *parts, unique=False, condition=None, method=None,
+			name=None):
+		'''
+		Create a new index. This should generally be done while defining the
+		attribute map of a model within it's decorator.
+		::parts The indexed column names, or callables that will be passed the
+			model class to yield a column or an expression `Node`.
+		::unique Whether this index enforces uniqueness.
+		::condition A callable that will be passed the model class to yield a
+			flag-like `Node`, making this a partial index.
+		::method The index method (e.g. `gin`), or `None` for the default.
+		::name The name of this index. If none is supplied, one will be
+			generated from the table name and attribute map key.
+		'''
+		super().__init__('UNIQUE INDEX' if unique else 'INDEX')
+		if not parts:
+			raise InvalidSchema('Index with no columns or expressions')
+		self.parts, self.condition = parts, condition
+		self.unique, self.method = unique, method
+		self.name, self.table = name, None
+
+	def bind(self, table):
+		'''Bind this index to its table.'''
+		self.table = table
+
+	def resolve_part(self, part):
+		'''Resolve an index part to a column or expression `Node`.'''
+		if isinstance(part, str):
+			if part not in self.table.columns:
+				raise InvalidSchema('Index %s on non-existant column %s'%(
+					self.name, part
+				))
+			return self.table.columns[part]
+		if callable(part):
+			part = part(self.table.model_cls)
+		return nodeify(deproxy(part))
+
+	def is_leading(self, column):
+		'''Return whether `column` is the first column of this index.'''
+		return self.resolve_part(self.parts[0]) is column
+
+	def describe(self, values=list()):
+		'''
+		Return the serialized description of this index. Values in expression
+		or condition nodes are appended to `values`.
+		'''
+		from .columns import Column
+
+		#	Columns are referenced by bare name.
+		name_policy = lambda column: column.name
+
+		parts = list()
+		for part in self.parts:
+			node = self.resolve_part(part)
+			if isinstance(node, Column):
+				parts.append(node.name)
+			else:
+				parts.append('(%s)'%node.serialize(values, name_policy))
+
+		sql = ' '.join((
+			self.name, 'ON', self.table.name,
+			*(('USING', self.method) if self.method else tuple()),
+			'(%s)'%', '.join(parts)
+		))
+		if self.condition is not None:
+			condition = nodeify(self.condition(self.table.model_cls))
+			if not isinstance(condition, MFlag):
+				raise InvalidSchema(
+					'Index %s has non flag-like condition'%self.name
+				)
+			sql = ' '.join((
+				sql, 'WHERE', condition.serialize(values, name_policy)
+			))
+		return sql
+
+	def serialize(self, values=None, name_policy=None):
+		'''Serialize a reference to this index.'''
+		return self.name
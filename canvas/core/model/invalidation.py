@@ -0,0 +1,263 @@
+# coding: utf-8
+'''
+Cross-process cache invalidation. Committing sessions announce the tables they
+wrote, either with `NOTIFY` or by incrementing their row in a version table,
+and a listener thread in each process invalidates the matching entries of the
+result cache and any other registered in-process cache.
+'''
+
+import os
+import select
+
+from threading import Thread, Event, Lock
+from psycopg2 import connect, Error as DatabaseError
+
+from ...configuration import config
+from ...utils import logger
+from .pool import primary_connect_args
+from .result_cache import get_result_cache
+from .type_adapters import ArrayParameter
+
+log = logger(__name__)
+
+#	The invalidation configuration used when the `database.invalidation`
+#	section is omitted.
+_default_invalidation_config = {
+	'enabled': False,
+	'mode': 'listen',
+	'channel': 'canvas_invalidate',
+	'poll_interval': 1
+}
+
+#	The name of the table of versions used in polling mode.
+VERSIONS_TABLE = 'canvas_table_versions'
+
+#	Callables invoked with the name of each invalidated table, or `None` if
+#	all tables should be considered invalidated.
+_invalidation_callbacks = list()
+
+def invalidation_config():
+	'''Return the invalidation configuration with defaults applied.'''
+	invalidation_config = dict(_default_invalidation_config)
+	invalidation_config.update(config.database.get('invalidation', dict()))
+	return invalidation_config
+
+def add_invalidation_callback(callback):
+	'''
+	Register `callback` to be invoked with the name of each table written by
+	another process, or `None` if any table may have been. Callbacks are
+	invoked on the listener thread.
+	'''
+	_invalidation_callbacks.append(callback)
+	return callback
+
+def invalidate(*names):
+	'''
+	Invalidate the cached results of the tables named `names`, or of all
+	tables if none are supplied.
+	'''
+	result_cache = get_result_cache()
+	if names:
+		result_cache.invalidate(*names)
+	else:
+		result_cache.clear()
+
+	for callback in _invalidation_callbacks:
+		for name in (names or (None,)):
+			callback(name)
+
+def create_versions_table(cursor):
+	'''Create the version table used in polling mode if it doesn't exist.'''
+	cursor.execute(' '.join((
+		'CREATE TABLE IF NOT EXISTS', VERSIONS_TABLE,
+		'(name TEXT PRIMARY KEY, version BIGINT NOT NULL);'
+	)))
+
+def emit_invalidations(session, tables, mode=None, channel=None):
+	'''
+	Announce that `tables` were written by `session`. In listening mode the
+	notifications are sent within the current transaction, so they're only
+	delivered once it's committed. In polling mode the versions are bumped
+	and committed in a short transaction of their own, so that writers don't
+	hold the version rows locked for the duration of their transactions; it
+	should be called after the writing transaction is committed.
+	::mode `listen` or `poll`, or `None` to use the configured mode.
+	::channel The notification channel, or `None` to use the configured one.
+	'''
+	policy = invalidation_config()
+	mode, channel = mode or policy['mode'], channel or policy['channel']
+	names = sorted(table.name for table in tables)
+
+	if mode == 'poll':
+		#	Rows are locked in name order to avoid deadlocks.
+		try:
+			session.execute(' '.join((
+				'INSERT INTO', VERSIONS_TABLE, '(name, version) VALUES',
+					', '.join(('(%s, 1)',)*len(names)),
+				'ON CONFLICT (name) DO UPDATE SET version =',
+					'%s.version + 1;'%VERSIONS_TABLE
+			)), names)
+			session.connection.commit()
+		except DatabaseError as ex:
+			#	The writes are already committed, so don't fail the caller.
+			log.warning('Failed to bump table versions: %s', ex)
+			session.connection.rollback()
+		session.writing = False
+	else:
+		session.execute(
+			'SELECT pg_notify(%s, name) FROM unnest(%s::TEXT[]) AS name;',
+			(channel, ArrayParameter(names))
+		)
+
+class InvalidationListener:
+	'''
+	A receiver of the invalidations announced by other processes, over a
+	dedicated connection. Listening mode waits for notifications, while
+	polling mode periodically reads the version table; for deployments in
+	which `LISTEN` is unavailable, such as behind transaction pooling.
+	'''
+
+	def __init__(self, connect_args, mode='listen', channel='canvas_invalidate',
+			poll_interval=1):
+		'''
+		::connect_args The keyword arguments to pass to `psycopg2.connect`.
+		::mode `listen` or `poll`.
+		::channel The notification channel to listen on.
+		::poll_interval The maximum number of seconds to wait for
+			notifications in each iteration, or the number of seconds between
+			reads of the version table.
+		'''
+		self.connect_args, self.mode = connect_args, mode
+		self.channel, self.poll_interval = channel, poll_interval
+		self.connection = self.thread = None
+		#	The last seen versions of each table in polling mode.
+		self.versions = None
+		self.stopped = Event()
+		self.pid = os.getpid()
+
+	def connect(self):
+		'''Open the dedicated connection and begin receiving invalidations.'''
+		self.connection = connect(**self.connect_args)
+		self.connection.autocommit = True
+
+		cursor = self.connection.cursor()
+		if self.mode == 'poll':
+			create_versions_table(cursor)
+			self.versions = self.read_versions(cursor)
+		else:
+			#	Channel names are identifiers.
+			cursor.execute('LISTEN "%s";'%self.channel.replace('"', '""'))
+		cursor.close()
+
+	def close(self):
+		'''Close the dedicated connection, ignoring failure.'''
+		if self.connection is not None:
+			try:
+				self.connection.close()
+			except DatabaseError:
+				pass
+			self.connection = None
+
+	def read_versions(self, cursor):
+		'''Return a dictionary of the versions in the version table.'''
+		cursor.execute('SELECT name, version FROM %s;'%VERSIONS_TABLE)
+		return dict(cursor.fetchall())
+
+	def poll(self, timeout=0):
+		'''
+		Wait up to `timeout` seconds for invalidations, then apply any that
+		were received. Return the list of invalidated table names.
+		'''
+		names = list()
+		if self.mode == 'poll':
+			if timeout:
+				self.stopped.wait(timeout)
+			cursor = self.connection.cursor()
+			versions = self.read_versions(cursor)
+			cursor.close()
+
+			names = [
+				name for name, version in versions.items()
+					if self.versions.get(name) != version
+			]
+			self.versions = versions
+		else:
+			if timeout:
+				select.select((self.connection,), tuple(), tuple(), timeout)
+			self.connection.poll()
+			while self.connection.notifies:
+				notify = self.connection.notifies.pop(0)
+				if notify.channel == self.channel:
+					names.append(notify.payload)
+
+		if names:
+			invalidate(*names)
+		return names
+
+	def run(self):
+		'''Receive invalidations until stopped, reconnecting on failure.'''
+		while not self.stopped.is_set():
+			try:
+				if self.connection is None:
+					self.connect()
+				self.poll(self.poll_interval)
+			except DatabaseError as ex:
+				log.warning('Invalidation listener failed: %s', ex)
+				self.close()
+				#	Invalidations may have been missed.
+				invalidate()
+				self.stopped.wait(self.poll_interval)
+		self.close()
+
+	def start(self):
+		'''
+		Connect, then receive invalidations on a daemon thread. If the 
+		connection fails, only local writes invalidate cached results until
+		the thread reconnects.
+		'''
+		try:
+			self.connect()
+		except DatabaseError as ex:
+			log.warning('Invalidation listener failed to connect: %s', ex)
+			self.close()
+		self.thread = Thread(
+			target=self.run, name='canvas-invalidation', daemon=True
+		)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		'''Stop receiving invalidations.'''
+		self.stopped.set()
+		if self.thread is not None:
+			self.thread.join()
+
+#	The listener of this process, started on first use.
+_listener = None
+#	The process in which the need for a listener was last checked.
+_listener_pid = None
+_listener_lock = Lock()
+
+def ensure_listener():
+	'''
+	Start the invalidation listener of this process if invalidation is
+	enabled and it isn't running, and return it or `None`. Since the check is
+	made per process, forked workers each start their own.
+	'''
+	global _listener, _listener_pid
+	pid = os.getpid()
+	if _listener_pid == pid:
+		return _listener
+
+	with _listener_lock:
+		if _listener_pid != pid:
+			#	Never re-use a listener inherited from a parent process.
+			_listener = None
+			policy = invalidation_config()
+			if policy['enabled']:
+				_listener = InvalidationListener(
+					primary_connect_args(), policy['mode'], policy['channel'],
+					policy['poll_interval']
+				).start()
+			_listener_pid = pid
+		return _listener
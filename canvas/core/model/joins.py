@@ -3,18 +3,66 @@
 The `Join` AST node and API definition.
 '''
 
+import copy
+
 from ...exceptions import InvalidQuery
+from ...configuration import config
 from .ast import Node, ISelectable, IJoinable, deproxy, nodeify
 from .columns import Column, ForeignKeyColumnType
 from .tables import Table
 
-#	TODO: Statefulness is a side-effect.
+def leading_table(joinable):
+	'''Return the first table joined in `joinable`.'''
+	while isinstance(joinable, Join):
+		joinable = joinable.source
+	return joinable
+
+class JoinPlan:
+	'''
+	The load plan of a join, compiled once so that loading a row doesn't 
+	rediscover the layout of the join.
+	'''
+
+	def __init__(self, join):
+		'''::join The `Join` to plan the loading of.'''
+		#	The columns of the join, in selection order.
+		self.columns = list(join.source.get_columns())
+		#	The width of the source segment.
+		self.source_width = len(self.columns)
+		#	A list of (destination, attachment attribute, segment start, 
+		#	segment end, link column, whether the link is from the destination)
+		#	tuples.
+		self.dests = list()
+		for dest, attr in zip(join.dests, join.attrs):
+			link_column, reverse = join.find_link_column(dest)
+			start = len(self.columns)
+			self.columns.extend(dest.get_columns())
+			self.dests.append((
+				dest, attr, start, len(self.columns), link_column, reverse
+			))
+		self.columns = tuple(self.columns)
+
+		#	Whether the join can be serialized without subqueries; nested 
+		#	joins must have no condition and must be linked by their leading
+		#	table.
+		self.flattenable = True
+		for child in (join.source, *join.dests):
+			if isinstance(child, Join) and (
+				child.condition is not True or not child.plan.flattenable
+			):
+				self.flattenable = False
+		for dest, attr, start, end, link_column, reverse in self.dests:
+			dest_column = link_column if reverse else link_column.type.target
+			if not leading_table(dest).contains_column(dest_column):
+				self.flattenable = False
 
 class Join(Node, ISelectable, IJoinable):
 	'''
 	`Join`s are selectable, joinable AST nodes. They represent the join of one
 	or more destination joinables (tables or subsequent joins) onto a source
-	joinable.
+	joinable. Joins aren't modified by being queried, so they can be defined 
+	once and shared between threads. Joins nested within another are copied
+	rather than renamed.
 	'''
 
 	def __init__(self, source):
@@ -32,34 +80,59 @@ class Join(Node, ISelectable, IJoinable):
 		self.source, self.dests = deproxy(source), list()
 		self.attrs = list()
 		self.condition = True
+		self._plan = None
+		#	Whether to serialize this join without subqueries when it's 
+		#	possible, or `None` to defer to the `database.flat_joins` option.
+		self.flat = None
 
-		self.reset()
+		self.set_name('_t')
 
 	@property
 	def is_empty(self):
 		return len(self.dests) == 0
 
-	def reset(self):
-		'''Reset this join's load state.'''
-		#	Define some loading state attributes.
-		self.source_obj = self.current_source_id = None
+	@property
+	def plan(self):
+		'''
+		The `JoinPlan` of this join, compiled on first use. Concurrent first 
+		uses may each compile an identical plan.
+		'''
+		plan = self._plan
+		if plan is None:
+			plan = self._plan = JoinPlan(self)
+		return plan
+
+	def adopt(self, child, name):
+		'''
+		Return `child` or, if it's a `Join`, a copy of it named `name` for use
+		as a constituent of this join.
+		'''
+		if isinstance(child, Join):
+			return child.renamed(name)
+		return child
+
+	def renamed(self, name):
+		'''Return a copy of this join and its `Join` children named `name`.'''
+		clone = copy.copy(self)
+		clone.attrs = list(self.attrs)
+		clone.set_name(name)
+		return clone
 
 	def set_name(self, name):
 		'''
 		Set the reference name of this join, and subsequently its `Join` 
-		children.
+		children. Should only be called on joins that haven't been shared.
 		'''
 		self.name = name
 
-		#	Rename child if it is a Join
-		def maybe_rename(child, c_name):
-			if isinstance(child, Join):
-				child.set_name(c_name)
-
-		#	Maybe rename each child.
-		maybe_rename(self.source, '%s_s'%self.name)
-		for i, dest in enumerate(self.dests):
-			maybe_rename(dest, '%s_d_%d'%(self.name, i))
+		#	Adopt each child with its name.
+		self.source = self.adopt(self.source, '%s_s'%self.name)
+		self.dests = [
+			self.adopt(dest, '%s_d_%d'%(self.name, i)) 
+				for i, dest in enumerate(self.dests)
+		]
+		#	Invalidate the load plan.
+		self._plan = None
 
 	def add(self, dest, condition=None, attr=None):
 		'''
@@ -67,12 +140,17 @@ class Join(Node, ISelectable, IJoinable):
 		those of the constructor.
 		'''
 		#	Store the destination and attribute name.
-		self.dests.append(deproxy(dest))
+		self.dests.append(self.adopt(
+			deproxy(dest), '%s_d_%d'%(self.name, len(self.dests))
+		))
 		self.attrs.append(attr)
+		#	Invalidate the load plan.
+		self._plan = None
 
-		#	Update the condition if nessesary.
-		if condition:
-			if not self.condition:
+		#	Update the condition if nessesary. `True` is the default of the 
+		#	model level `join` method.
+		if condition is not None and condition is not True:
+			if self.condition is True:
 				self.condition = nodeify(condition)
 			else:
 				self.condition &= nodeify(condition)
@@ -80,75 +158,44 @@ class Join(Node, ISelectable, IJoinable):
 		#	Chain.
 		return self
 	
-	#	TODO: Golf this method.
+	def create_loader(self):
+		'''Return a new `JoinLoader` for an execution of this join.'''
+		return JoinLoader(self)
+	
 	def load_next(self, row_segment, session):
 		'''
-		Return the constituents of this join loaded onto `row_segment` or 
-		return `None`.
+		Return the constituents of this join loaded onto `row_segment` with a
+		new loader. Loading the rows of a query requires a single loader.
 		'''
-		if not row_segment:
-			return None
-
-		#	Check if the source model instance has changed.
-		if row_segment[0] != self.current_source_id:
-			if row_segment[0] is None:
-				return None
-			#	Create a new source model instance and store it's ID.
-			self.source_obj = self.source.load_next(row_segment, session)
-			self.current_source_id = row_segment[0]
-		
-		if not hasattr(self.source_obj, '__joined__'):
-			self.source_obj.__joined__ = list()
-		self.source_obj.__joined__.extend(self.attrs)
+		return self.create_loader().load_next(row_segment, session)
 
-		#	k tracks the current offset into the row segment.
-		k = len(self.source.get_columns())
-		#	Iterate destination constituents.
-		for dest, attach_attr in zip(self.dests, self.attrs):
-			#	Create the sub segment and check relation direction.
-			sub_segment = row_segment[k:]
-			link_column, is_many_attachment = self.find_link_column(dest)
-			#	Allow the destination constituent to load the segment or 
-			#	don't if
-			if sub_segment[0] is not None:
-				next_instance = dest.load_next(sub_segment, session)
-			else:
-				next_instance = None
-			
-			if not attach_attr:
-				#	TODO: What do we want to do here?
-				raise InvalidQuery(
-					'No attachment attribute specified in join'
-				)
-
-			if is_many_attachment:
-				#	Assert the attachment array exists.
-				if not hasattr(self.source_obj, attach_attr):
-					setattr(self.source_obj, attach_attr, list())
-
-				if next_instance:
-					#	Check whether this is a reload and add to the 
-					#	attaching array if not.
-					attaching = getattr(self.source_obj, attach_attr)
-					contains = False
-					for item in attaching:
-						if item is next_instance:
-							contains = True
-							break
-					if not contains:
-						attaching.append(next_instance)
-			else:
-				#	Directly attach the result.
-				setattr(self.source_obj, attach_attr, next_instance)
-
-			#	Increment k into the row segement.
-			k += len(dest.get_columns())
-			
-		return self.source_obj
+	@property
+	def is_flat(self):
+		'''Whether this join is serialized without subqueries.'''
+		flat = self.flat
+		if flat is None:
+			flat = config.database.get('flat_joins', False)
+		return flat and self.plan.flattenable
 
 	def serialize(self, values=None, name_policy=None):
 		return self.name
 
+	def shape(self, values):
+		'''
+		Key the complete serialization of this join as a selection source,
+		collecting values in the same order as `serialize_source`.
+		'''
+		parts = [self.source.shape(values)]
+		parts.extend(dest.shape(values) for dest in self.dests)
+		if self.condition:
+			parts.append(nodeify(self.condition).shape(values))
+		else:
+			parts.append(('literal', 'TRUE'))
+		
+		if None in parts:
+			return None
+		return ('join', self.name, self.is_flat, *parts)
+
 	def serialize_selection(self, name_policy=None):
 		'''
 		Return the serialization of the columns in this join, honouring 
@@ -175,9 +222,7 @@ class Join(Node, ISelectable, IJoinable):
 	def serialize_source(self, values=list()):
 		'''Return the serialization the `JOIN` itself.'''
 		#	Serialize a single destination as JOIN <x> ON <y>.
-		def one_join(dest):
-			#	Resolve the link and direction.
-			link_column, reverse = self.find_link_column(dest)
+		def one_join(dest, link_column, reverse):
 			on_src, on_dest = (dest, self.source) if reverse else (self.source, dest)
 
 			#	Serialize.
@@ -211,9 +256,13 @@ class Join(Node, ISelectable, IJoinable):
 					]),
 				'FROM', 
 					self.source.serialize_source(values), 
-					*(one_join(dest) for dest in self.dests),
+					*(
+						one_join(dest, link_column, reverse) for 
+							dest, attr, start, end, link_column, reverse in 
+								self.plan.dests
+					),
 				'WHERE', (
-					self.condition.serialize(values, name_policy=query_name_policy) if self.condition else 'TRUE'
+					nodeify(self.condition).serialize(values, name_policy=query_name_policy)
 				),
 			') AS', self.name
 		))
@@ -248,6 +297,93 @@ class Join(Node, ISelectable, IJoinable):
 			self.source.name, dest.name
 		))
 
+	def select_name_column(self, column):
+		'''
+		Return the name of the constituent `column` in a selection of this 
+		join.
+		'''
+		if self.is_flat:
+			return self.flat_name_column(column)
+		return self.name_column(column)
+
+	def flat_name_column(self, column):
+		'''
+		Return the name of the constituent `column` when this join is 
+		flattened, qualified by the alias of its table.
+		'''
+		for alias, child in self.flat_children():
+			if isinstance(child, Join):
+				if child.contains_column(column):
+					return child.flat_name_column(column)
+			elif child.contains_column(column):
+				return '.'.join((alias, column.name))
+		raise InvalidQuery('No column %s in join'%column.name)
+
+	def flat_children(self):
+		'''
+		Return a list of alias, joinable tuples for the source and each
+		destination of this join when flattened.
+		'''
+		return [
+			('%s_s'%self.name, self.source),
+			*(
+				('%s_d_%d'%(self.name, i), dest) 
+					for i, dest in enumerate(self.dests)
+			)
+		]
+
+	def serialize_flat_selection(self):
+		'''Return the selection of the columns of this join when flattened.'''
+		selection = list()
+		for alias, child in self.flat_children():
+			if isinstance(child, Join):
+				selection.append(child.serialize_flat_selection())
+			else:
+				selection.extend(
+					'.'.join((alias, column.name)) 
+						for column in child.get_columns()
+				)
+		return ', '.join(selection)
+
+	def serialize_flat_source(self, on=None):
+		'''
+		Return the serialization of the tables of this join as a single list
+		of `JOIN`s.
+		::on The serialized condition on which the leading table of this join
+			is joined, or `None` if this is the outermost join.
+		'''
+		def one_table(table, alias, on):
+			sql = ' '.join((table.name, 'AS', alias))
+			if on is None:
+				return sql
+			return ' '.join(('LEFT OUTER JOIN', sql, 'ON', on))
+
+		def one_child(alias, child, on):
+			if isinstance(child, Join):
+				return child.serialize_flat_source(on)
+			return one_table(child, alias, on)
+		
+		def name_in(alias, child, column):
+			if isinstance(child, Join):
+				return child.flat_name_column(column)
+			return '.'.join((alias, column.name))
+
+		source_alias = '%s_s'%self.name
+		clauses = [one_child(source_alias, self.source, on)]
+		for i, (dest, attr, start, end, link_column, reverse) in \
+				enumerate(self.plan.dests):
+			alias = '%s_d_%d'%(self.name, i)
+			#	Resolve the link and direction.
+			if reverse:
+				on_dest, on_src = link_column, link_column.type.target
+			else:
+				on_src, on_dest = link_column, link_column.type.target
+			clauses.append(one_child(alias, dest, ' '.join((
+				name_in(source_alias, self.source, on_src), '=',
+				name_in(alias, dest, on_dest)
+			))))
+		return ' '.join(clauses)
+
 	#	TODO: Golf.
 	def name_column(self, column, for_query=False):
 		'''Return the name of the constituent `column`.'''
@@ -264,7 +400,91 @@ class Join(Node, ISelectable, IJoinable):
 
 	def get_columns(self):
 		'''Return all constituent columns.'''
-		dest_columns = list()
-		for dest in self.dests:
-			dest_columns.extend(dest.get_columns())
-		return (*self.source.get_columns(), *dest_columns)
+		return self.plan.columns
+
+class JoinLoader:
+	'''
+	The load state of a single execution of a query of a join. Loading is
+	cheapest when the rows of each source model are adjacent.
+	'''
+
+	def __init__(self, join):
+		'''::join The `Join` being loaded.'''
+		self.join, self.plan = join, join.plan
+		#	The loaders of the source and each destination.
+		self.source_loader = join.source.create_loader()
+		self.dest_loaders = [
+			(dest.create_loader(), *step) 
+				for dest, *step in self.plan.dests
+		]
+		#	The current source model and its primary key value.
+		self.source_obj = self.current_source_id = None
+		#	A map of attachment attribute to the identity set of the models
+		#	attached to the current source model.
+		self.attached = dict()
+
+	def load_next(self, row_segment, session):
+		'''
+		Return the constituents of the join loaded onto `row_segment` or 
+		return `None`.
+		'''
+		if not row_segment:
+			return None
+
+		#	Check if the source model instance has changed.
+		if row_segment[0] != self.current_source_id:
+			if row_segment[0] is None:
+				return None
+			#	Create a new source model instance and store it's ID.
+			self.source_obj = self.source_loader.load_next(
+				row_segment[:self.plan.source_width], session
+			)
+			self.current_source_id = row_segment[0]
+			self.attached = dict()
+		
+			if not hasattr(self.source_obj, '__joined__'):
+				self.source_obj.__joined__ = list()
+			joined = self.source_obj.__joined__
+			joined.extend(
+				attr for attr in self.join.attrs if attr not in joined
+			)
+
+		#	Iterate destination constituents.
+		for loader, attach_attr, start, end, link, is_many in \
+				self.dest_loaders:
+			#	Allow the destination constituent to load its segment if the
+			#	row contains one.
+			if row_segment[start] is not None:
+				next_instance = loader.load_next(
+					row_segment[start:end], session
+				)
+			else:
+				next_instance = None
+			
+			if not attach_attr:
+				#	TODO: What do we want to do here?
+				raise InvalidQuery(
+					'No attachment attribute specified in join'
+				)
+
+			if is_many:
+				attached = self.attached.get(attach_attr)
+				if attached is None:
+					#	Assert the attachment array exists, and retrieve the 
+					#	identities of the models already attached to it.
+					if not hasattr(self.source_obj, attach_attr):
+						setattr(self.source_obj, attach_attr, list())
+					attached = self.attached[attach_attr] = set(
+						id(item) for item in 
+							getattr(self.source_obj, attach_attr)
+					)
+
+				#	Add to the attaching array if this isn't a reload.
+				if next_instance and id(next_instance) not in attached:
+					attached.add(id(next_instance))
+					getattr(self.source_obj, attach_attr).append(next_instance)
+			else:
+				#	Directly attach the result.
+				setattr(self.source_obj, attach_attr, next_instance)
+			
+		return self.source_obj
@@ -6,17 +6,24 @@ The base `Model` class and `model` decorator definitions. Inheritance over
 
 from ...exceptions import NotFound
 from .tables import Table
-from .columns import Column
 from .dictizations import resolve_dictized_properties
 from .relationalism import RelationSpec
 
 class Model:
 	'''
-	The base model class implements session, dirty attribute, and lazy-load 
-	tracking as well as several convenience methods.
+	The base model class implements session and dirty attribute tracking as 
+	well as several convenience methods. Lazy-loading is implemented by the 
+	`Column`s bound to the model class.
+
+	Assignments to columns are only recorded as touched; the values of 
+	touched columns are compared with a snapshot of the loaded row when the
+	model is flushed.
 	'''
+	#	Instances of plain models have the `__dict__` of their defining class,
+	#	while compact models are entirely slotted.
+	__slots__ = tuple()
 	#	Ensure these exist in the MRO.
-	__table__ = __session__ = __dirty__ = None
+	__table__ = __session__ = __dirty__ = __snapshot__ = None
 
 	@classmethod
 	def join(cls, other=None, condition=True, attr=None):
@@ -43,62 +50,270 @@ class Model:
 	def get(cls, pk_val, session):
 		return session.query(cls, cls.__table__.primary_key == pk_val, one=True)
 
+	def __hydrate__(self, row_segment):
+		'''
+		Assign the non-lazy column values in `row_segment` without dirty 
+		tracking, retaining them as the clean snapshot.
+		'''
+		names = self.__table__.eager_names
+		if len(row_segment) != len(names):
+			row_segment = row_segment[:len(names)]
+		
+		values = self.__dict__
+		values.update(zip(names, row_segment))
+		values['__snapshot__'] = row_segment
+
 	def __loaded__(self, session):
-		'''A callback invoked immediatly after a model is loaded.'''
-		self.__dirty__ = dict()
+		'''
+		A callback invoked immediatly after a model is loaded, saved, or 
+		updated.
+		'''
+		if self.__dirty__ is not None or self.__snapshot__ is None:
+			#	Snapshot the current values, which are now clean.
+			self.__snapshot__ = tuple(
+				self.__dict__.get(name) for name in self.__table__.eager_names
+			)
+		self.__dirty__ = None
 		self.__session__ = session
 
-	def __getattribute__(self, key):
-		'''Retrieve lazy-loaded attributes from the database when accessed.'''
-		#	TODO: Clean this up its a shitshow.
-		table = super().__getattribute__('__class__').__table__
-		must_load = (
-			super().__getattribute__('__session__') and 
-			key in table.columns and 
-			isinstance(super().__getattribute__(key), Column)
-		)
-		if must_load:
-			row_access = super().__getattribute__(table.primary_key.name)
-			value = self.__session__.query(
-				table.columns[key], 
-				table.primary_key == row_access, 
-				one=True
-			)
-			setattr(self, key, value)
-			return value
+	def __setattr__(self, key, value):
+		'''
+		Record in-schema attributes as touched when assigned, informing the 
+		session when the model becomes dirty.
+		'''
+		became_dirty = False
+		if key in self.__table__.columns:
+			if self.__dirty__ is None:
+				became_dirty = True
+				object.__setattr__(self, '__dirty__', {key})
+			else:
+				self.__dirty__.add(key)
+
+		super().__setattr__(key, value)
+		if became_dirty and self.__session__:
+			self.__session__.mark_dirty(self)
+
+	def __value__(self, key, default=None):
+		'''
+		Return the value of the column `key` without lazy-loading it, or 
+		`default` if it isn't loaded.
+		'''
+		return self.__dict__.get(key, default)
+
+	def __dirty_columns__(self):
+		'''
+		Return the touched columns of this model whose values differ from the
+		snapshot in table order. Touched lazy columns are always dirty.
+		'''
+		touched, snapshot = self.__dirty__, self.__snapshot__
+		if not touched:
+			return list()
 
-		return super().__getattribute__(key)
+		dirty, values, i = list(), self.__dict__, 0
+		for name, column in self.__table__.columns.items():
+			lazy = column.type.lazy
+			if name in touched:
+				if lazy or snapshot is None:
+					dirty.append(column)
+				else:
+					value, clean_value = values.get(name), snapshot[i]
+					if value is not clean_value and value != clean_value:
+						dirty.append(column)
+			if not lazy:
+				i += 1
+		return dirty
+
+	def __revert__(self):
+		'''
+		Restore the snapshot values of touched columns. Touched lazy columns
+		are unset so they're lazy-loaded again.
+		'''
+		touched, snapshot = self.__dirty__, self.__snapshot__
+		if not touched:
+			return
+		
+		values, i = self.__dict__, 0
+		for name, column in self.__table__.columns.items():
+			lazy = column.type.lazy
+			if name in touched:
+				if lazy or snapshot is None:
+					values.pop(name, None)
+				else:
+					values[name] = snapshot[i]
+			if not lazy:
+				i += 1
+
+class ColumnSlot:
+	'''
+	The class attribute for a column of a compact model, which stores the
+	column's values in a hidden slot. Class access returns the `Column` and 
+	reading an unset slot lazy-loads the value.
+	'''
+	__slots__ = ('column', 'slot')
+
+	def __init__(self, column, slot):
+		'''
+		::column The `Column`.
+		::slot The member descriptor of the hidden slot.
+		'''
+		self.column, self.slot = column, slot
+
+	def __get__(self, instance, owner=None):
+		if instance is None:
+			return self.column
+		try:
+			return self.slot.__get__(instance, owner)
+		except AttributeError:
+			return self.column.__get__(instance, owner)
+	
+	def __set__(self, instance, value):
+		self.slot.__set__(instance, value)
+	
+	def __delete__(self, instance):
+		self.slot.__delete__(instance)
+
+class CompactModel(Model):
+	'''
+	The base class of models defined with `slots=True`. Column values are 
+	stored in a fixed slot layout and assigned columns are tracked with a 
+	bitmask. Since no snapshot is retained, all assigned columns are dirty 
+	and rollback unsets them so they're lazy-loaded again on access.
+
+	Instances have no `__dict__`. Other attributes, such as cached relations
+	and join attachments, are stored in a dictionary created on first use.
+	'''
+	__slots__ = (
+		'__session__', '__dirty__', '__joined__', '__relations__', 
+		'__weakref__'
+	)
+	#	A map of column names to dirty bit, slot member descriptor pairs, and 
+	#	the slot member descriptors of non-lazy columns, assigned per class.
+	__layout__, __eager_slots__ = dict(), tuple()
+
+	def __new__(cls, *args, **kwargs):
+		instance = super().__new__(cls)
+		object.__setattr__(instance, '__session__', None)
+		object.__setattr__(instance, '__dirty__', 0)
+		object.__setattr__(instance, '__relations__', None)
+		return instance
+
+	def __getattr__(self, key):
+		'''Return the value of the non-column, non-slot attribute `key`.'''
+		relations = self.__relations__
+		if relations is None or key not in relations:
+			raise AttributeError(key)
+		return relations[key]
+
+	def __hydrate__(self, row_segment):
+		'''
+		Assign the non-lazy column values in `row_segment` without dirty 
+		tracking.
+		'''
+		for slot, value in zip(self.__eager_slots__, row_segment):
+			slot.__set__(self, value)
+
+	def __loaded__(self, session):
+		'''
+		A callback invoked immediatly after a model is loaded, saved, or 
+		updated.
+		'''
+		object.__setattr__(self, '__dirty__', 0)
+		object.__setattr__(self, '__session__', session)
 
 	def __setattr__(self, key, value):
-		'''Set the dirty flag for in-schema attributes when assigned.'''
-		if key in self.__table__.columns:
-			if key not in self.__dirty__:
-				existing = super().__getattribute__(key)
-				if not isinstance(existing, Column) and value != existing:
-					self.__dirty__[key] = value
+		'''
+		Set the dirty bit for in-schema attributes when assigned, informing
+		the session when the model becomes dirty.
+		'''
+		layout = self.__layout__.get(key)
+		if layout is None:
+			try:
+				object.__setattr__(self, key, value)
+			except AttributeError:
+				#	Store attributes without a slot or descriptor.
+				if self.__relations__ is None:
+					object.__setattr__(self, '__relations__', dict())
+				self.__relations__[key] = value
+			return
+		
+		bit, slot = layout
+		dirty = self.__dirty__
+		slot.__set__(self, value)
+		if not dirty & bit:
+			object.__setattr__(self, '__dirty__', dirty | bit)
+			if not dirty and self.__session__:
+				self.__session__.mark_dirty(self)
+
+	def __value__(self, key, default=None):
+		'''
+		Return the value of the column `key` without lazy-loading it, or 
+		`default` if it isn't loaded.
+		'''
+		try:
+			return self.__layout__[key][1].__get__(self)
+		except AttributeError:
+			return default
+
+	def __dirty_columns__(self):
+		'''Return the dirty columns of this model in table order.'''
+		dirty = self.__dirty__
+		return [
+			column for name, column in self.__table__.columns.items()
+				if dirty & self.__layout__[name][0]
+		]
 
-		return super().__setattr__(key, value)
+	def __revert__(self):
+		'''Unset dirty columns so that they're lazy-loaded again.'''
+		dirty = self.__dirty__
+		for bit, slot in self.__layout__.values():
+			if dirty & bit:
+				try:
+					slot.__delete__(self)
+				except AttributeError:
+					pass
 
-def model(table_name, contents, dictized=tuple()):
+def model(table_name, contents, dictized=tuple(), slots=False, cache=False):
 	'''
 	The `model` class decorator is used to define properties of a model class.
 	::table_name The name of the table in which to store instances of this 
 		model.
 	::contents A dictionary containing the name, column or constraint pairs 
 		that define the schema of the model.
+	::slots Whether to define a compact model, which stores column values in
+		slots and tracks dirty columns with a bitmask rather than retaining
+		clean values. The class is rebuilt over `CompactModel`, so its methods
+		can't use argumentless `super()`.
+	::cache Whether queries of only this model and other cached models cache
+		their results by default. Suited to rarely modified reference data.
 	'''
 	def model_inner(cls):
-		#	Patch the type to extend Model.
-		_Model = type(cls.__name__, (cls, Model), dict())
-		_Model.__dictized__ = list(dictized)
-		resolve_dictized_properties(_Model)
 		#	Create the table.
 		table = Table(table_name, contents)
+		table.cache_results = cache
+		
+		if slots:
+			#	Rebuild the type over CompactModel with a slot per column.
+			namespace = {
+				key: value for key, value in cls.__dict__.items() 
+					if key not in ('__dict__', '__weakref__')
+			}
+			namespace['__qualname__'] = cls.__qualname__
+			namespace['__slots__'] = tuple(
+				'_cv_%s'%name for name in table.columns
+			)
+			_Model = type(cls.__name__, (
+				*(base for base in cls.__bases__ if base is not object), 
+				CompactModel
+			), namespace)
+		else:
+			#	Patch the type to extend Model.
+			_Model = type(cls.__name__, (cls, Model), dict())
+		_Model.__dictized__ = list(dictized)
+		resolve_dictized_properties(_Model)
 
 		#	Override __init__ to assign default or sentinel values.
 		inner_init = _Model.__init__
 		def init_wrap(self, *args, **kwargs):
-			self.__dirty__ = dict()
 			for column in table.columns.values():
 				column.apply_to_model(self)
 			inner_init(self, *args, **kwargs)
@@ -106,6 +321,17 @@ def model(table_name, contents, dictized=tuple()):
 
 		#	Bind the table.
 		table.bind(_Model)
+		if slots:
+			#	Replace the bound columns with slot accessors.
+			layout = dict()
+			for i, (name, column) in enumerate(table.columns.items()):
+				slot = ColumnSlot(column, _Model.__dict__['_cv_%s'%name])
+				setattr(_Model, name, slot)
+				layout[name] = (1 << i, slot.slot)
+			_Model.__layout__ = layout
+			_Model.__eager_slots__ = tuple(
+				layout[name][1] for name in table.eager_names
+			)
 
 		return _Model
 	return model_inner
@@ -0,0 +1,62 @@
+# coding: utf-8
+'''
+Keyset pagination helpers. Rather than skipping rows with `OFFSET`, pages
+after the first select the rows following the order key values of the last
+row seen, which are passed between requests as opaque cursor tokens.
+'''
+
+import json
+import base64
+import binascii
+
+from uuid import UUID
+from decimal import Decimal
+from datetime import datetime, date, time
+
+from ...exceptions import InvalidQuery, BadRequest
+
+def keyset_order(table, order):
+	'''
+	Return `order` as a tuple of `OrderItem`s suitable for keyset pagination
+	of `table`, with the primary key appended as a tie-breaker if it isn't
+	already present.
+	'''
+	if not isinstance(order, (list, tuple)):
+		order = (order,)
+
+	for item in order:
+		if item.column.table is not table:
+			raise InvalidQuery('Keyset order column %s is not of %s'%(
+				item.column.name, table.name
+			))
+	if not any(item.column is table.primary_key for item in order):
+		order = (*order, table.primary_key.asc)
+	return tuple(order)
+
+def encode_key(value):
+	'''Return a JSON-safe representation of the order key value `value`.'''
+	if isinstance(value, (datetime, date, time)):
+		#	Retain full precision, unlike the configured output format.
+		return value.isoformat()
+	if isinstance(value, (UUID, Decimal)):
+		return str(value)
+	raise TypeError(type(value))
+
+def encode_cursor(keys):
+	'''Return an opaque cursor token for the order key values `keys`.'''
+	return base64.urlsafe_b64encode(
+		json.dumps(keys, default=encode_key, separators=(',', ':')).encode()
+	).decode()
+
+def decode_cursor(token):
+	'''
+	Return the order key values encoded in the cursor token `token`, raising
+	a `BadRequest` if it's malformed.
+	'''
+	try:
+		keys = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+	except (ValueError, binascii.Error):
+		raise BadRequest('Invalid cursor') from None
+	if not isinstance(keys, list):
+		raise BadRequest('Invalid cursor')
+	return keys
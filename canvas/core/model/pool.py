@@ -0,0 +1,308 @@
+# coding: utf-8
+'''
+The process-wide database connection pools. `Session`s check a connection out
+of the pool when they first emit SQL and check it back in when closed, so that
+requests don't pay for a connection handshake each. Read replicas listed in
+`database.replicas` each have a pool of their own.
+'''
+
+import os
+import copy
+import time
+import itertools
+
+from threading import Condition, Lock
+from psycopg2 import connect, Error as DatabaseError
+
+from ...exceptions import PoolExhausted
+from ...configuration import config
+from ...utils import logger
+
+log = logger(__name__)
+
+#	The pool configuration used when the `database.pool` section is omitted.
+_default_pool_config = {
+	'min_size': 1,
+	'max_size': 20,
+	'idle_timeout': 300,
+	'max_lifetime': 3600,
+	'check_on_checkout': True,
+	'checkout_timeout': 30
+}
+
+class PooledConnection:
+	'''
+	A wrapper around a live connection that maintains the book-keeping the
+	pool requires.
+	'''
+
+	def __init__(self, pool, connection):
+		'''
+		::pool The owning `ConnectionPool`.
+		::connection The underlying `psycopg2` connection.
+		'''
+		self.pool, self.connection = pool, connection
+		self.created = self.last_used = time.time()
+		#	The `PreparedStatements` registry for this connection, created
+		#	when a statement is first prepared on it.
+		self.prepared = None
+
+	@property
+	def is_broken(self):
+		'''Whether the underlying connection is no longer usable.'''
+		return bool(self.connection.closed)
+
+	def check(self):
+		'''Return whether the connection is healthy, with a round trip.'''
+		try:
+			cursor = self.connection.cursor()
+			cursor.execute('SELECT 1;')
+			cursor.close()
+			self.connection.rollback()
+			return True
+		except DatabaseError:
+			return False
+
+	def release(self):
+		'''Check this connection back in to its pool.'''
+		self.pool.checkin(self)
+
+	def close(self):
+		'''Close the underlying connection, ignoring failure.'''
+		try:
+			self.connection.close()
+		except DatabaseError:
+			pass
+
+class ConnectionPool:
+	'''
+	A thread-safe, bounded pool of database connections. Idle and aged
+	connections are culled lazily on check in and check out rather than by a
+	background thread.
+	'''
+
+	def __init__(self, connect_args, min_size=1, max_size=20,
+			idle_timeout=300, max_lifetime=3600, check_on_checkout=True,
+			checkout_timeout=30, autocommit=False):
+		'''
+		Create a new connection pool.
+		::connect_args The keyword arguments to pass to `psycopg2.connect`.
+		::min_size The number of idle connections kept open regardless of
+			`idle_timeout`.
+		::max_size The maximum number of simultaneously open connections.
+		::idle_timeout The number of seconds after which a surplus idle
+			connection is closed, or `None`.
+		::max_lifetime The number of seconds after which a connection is
+			retired, or `None`.
+		::check_on_checkout Whether to issue a health check before handing out
+			an idle connection.
+		::checkout_timeout The number of seconds to wait for a connection
+			when the pool is exhausted before raising `PoolExhausted`.
+		::autocommit Whether connections are placed in autocommit mode, so
+			that reads don't hold open transactions.
+		'''
+		self.connect_args, self.autocommit = connect_args, autocommit
+		self.min_size, self.max_size = min_size, max_size
+		self.idle_timeout, self.max_lifetime = idle_timeout, max_lifetime
+		self.check_on_checkout = check_on_checkout
+		self.checkout_timeout = checkout_timeout
+
+		#	Idle connections are used last-in, first-out so that surplus
+		#	connections remain idle long enough to be culled.
+		self.idle, self.size = list(), 0
+		self.condition = Condition()
+		#	Remember the creating process so inherited connections are never
+		#	shared across a fork.
+		self.pid = os.getpid()
+
+	def is_expired(self, pooled, now):
+		'''Return whether `pooled` has exceeded its maximum lifetime.'''
+		return bool(self.max_lifetime) and \
+				now - pooled.created > self.max_lifetime
+
+	def discard(self, pooled):
+		'''Close and forget a connection. The caller must hold the lock.'''
+		self.size -= 1
+		pooled.close()
+		self.condition.notify()
+
+	def cull(self, now):
+		'''
+		Close surplus idle connections beyond their idle timeout and any
+		expired ones. The caller must hold the lock.
+		'''
+		for pooled in list(self.idle):
+			surplus = self.size > self.min_size and self.idle_timeout and \
+					now - pooled.last_used > self.idle_timeout
+			if surplus or self.is_expired(pooled, now):
+				self.idle.remove(pooled)
+				self.discard(pooled)
+
+	def checkout(self):
+		'''Return a `PooledConnection`, creating one if required.'''
+		deadline = time.time() + self.checkout_timeout
+		while True:
+			pooled = None
+			with self.condition:
+				while True:
+					now = time.time()
+					self.cull(now)
+
+					#	Prefer an idle connection.
+					if self.idle:
+						pooled = self.idle.pop()
+						break
+					#	Reserve room for a new connection if there is any.
+					if self.size < self.max_size:
+						self.size += 1
+						break
+
+					#	Wait for a connection to be returned.
+					remaining = deadline - now
+					if remaining <= 0:
+						raise PoolExhausted(self.max_size)
+					self.condition.wait(remaining)
+
+			if pooled is None:
+				#	Connect outside of the lock.
+				try:
+					connection = connect(**self.connect_args)
+					connection.autocommit = self.autocommit
+					return PooledConnection(self, connection)
+				except:
+					with self.condition:
+						self.size -= 1
+						self.condition.notify()
+					raise
+
+			#	Check the idle connection outside of the lock, discarding it
+			#	and retrying if it's unhealthy.
+			if not pooled.is_broken and (
+				not self.check_on_checkout or pooled.check()
+			):
+				return pooled
+			log.warning('Discarding unhealthy pooled connection')
+			with self.condition:
+				self.discard(pooled)
+
+	def checkin(self, pooled):
+		'''
+		Return `pooled` to the pool, rolling back any open transaction. Broken
+		or expired connections are closed instead.
+		'''
+		now = time.time()
+		pooled.last_used = now
+
+		#	Roll back outside of the lock, since it's a round trip.
+		healthy = not pooled.is_broken and not self.is_expired(pooled, now)
+		if healthy:
+			try:
+				pooled.connection.rollback()
+			except DatabaseError:
+				healthy = False
+
+		with self.condition:
+			if healthy:
+				self.idle.append(pooled)
+				self.condition.notify()
+			else:
+				self.discard(pooled)
+
+			self.cull(now)
+
+	def close(self):
+		'''Close all idle connections.'''
+		with self.condition:
+			while self.idle:
+				self.discard(self.idle.pop())
+
+#	The process-wide pool, created on first use.
+_pool = None
+#	The process-wide replica pools, created on first use, and the replica
+#	configuration they were created for.
+_replica_pools = _replica_config = None
+#	A counter used to distribute sessions across replicas.
+_replica_counter = itertools.count()
+#	Pools inherited across a fork. They're referenced but never used since
+#	closing their connections would terminate the parent's.
+_inherited_pools = list()
+_pool_lock = Lock()
+
+def pool_config():
+	'''Return the pool configuration with defaults applied.'''
+	pool_config = dict(_default_pool_config)
+	pool_config.update(config.database.get('pool', dict()))
+	return pool_config
+
+def primary_connect_args():
+	'''Return the connection arguments of the primary database.'''
+	return {
+		'database': config.database.database,
+		'user': config.database.user,
+		'password': config.database.password,
+		'host': config.database.host
+	}
+
+def get_pool():
+	'''Return the process-wide connection pool, creating it if required.'''
+	global _pool
+	with _pool_lock:
+		if _pool is None or _pool.pid != os.getpid():
+			if _pool is not None:
+				#	Never re-use a pool inherited from a parent process; its
+				#	connections belong to the parent.
+				_inherited_pools.append(_pool)
+
+			_pool = ConnectionPool(primary_connect_args(), **pool_config())
+
+		return _pool
+
+def get_replica_pools():
+	'''
+	Return the list of process-wide replica connection pools, creating them 
+	if required. Each entry of `database.replicas` is either a host name or
+	a dictionary of connection arguments that override those of the primary.
+	The pools are recreated if the configured replicas change.
+	'''
+	global _replica_pools, _replica_config
+	with _pool_lock:
+		replicas = config.database.get('replicas', list())
+		if _replica_pools is None or replicas != _replica_config or (
+			_replica_pools and _replica_pools[0].pid != os.getpid()
+		):
+			if _replica_pools:
+				if _replica_pools[0].pid == os.getpid():
+					#	Close the idle connections of replaced pools.
+					for pool in _replica_pools:
+						pool.close()
+				else:
+					_inherited_pools.extend(_replica_pools)
+			
+			_replica_pools, _replica_config = list(), copy.deepcopy(replicas)
+			for replica in replicas:
+				if isinstance(replica, str):
+					replica = {'host': replica}
+				connect_args = primary_connect_args()
+				connect_args.update(replica)
+				_replica_pools.append(ConnectionPool(
+					connect_args, autocommit=True, **pool_config()
+				))
+		
+		return _replica_pools
+
+def get_replica_pool():
+	'''
+	Return the next replica connection pool in rotation, or `None` if no 
+	replicas are configured.
+	'''
+	pools = get_replica_pools()
+	if not pools:
+		return None
+	return pools[next(_replica_counter)%len(pools)]
+
+def close_pool():
+	'''Close all idle connections in the process-wide pools.'''
+	if _pool is not None:
+		_pool.close()
+	for pool in _replica_pools or tuple():
+		pool.close()
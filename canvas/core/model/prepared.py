@@ -0,0 +1,110 @@
+# coding: utf-8
+'''
+Opt-in server-side prepared statement management. Statements whose compiled
+SQL is executed often enough across the process are promoted to `PREPARE`d
+statements on each pooled connection that executes them, allowing Postgres
+to skip parsing and planning. Each connection retains a bounded number of
+prepared statements, deallocating the least recently used.
+'''
+
+import re
+
+from threading import Lock
+from collections import OrderedDict
+
+from ...configuration import config
+
+#	The prepared statement configuration used when the
+#	`database.prepared_statements` section is omitted.
+_default_prepared_config = {
+	'enabled': False,
+	'threshold': 5,
+	'max_per_connection': 128
+}
+
+#	The maximum number of distinct statements for which execution counts are
+#	kept before counting restarts.
+_max_tracked = 4096
+
+#	Process-wide execution counts keyed by SQL, and the set of SQL that
+#	Postgres refused to prepare.
+_execution_counts, _unpreparable = dict(), set()
+_counts_lock = Lock()
+
+#	The pattern matching psycopg2 placeholders and escapes.
+_placeholder_regex = re.compile(r'%(%|s)')
+
+def prepared_config():
+	'''Return the effective prepared statement configuration.'''
+	prepared_config = dict(_default_prepared_config)
+	prepared_config.update(config.database.get('prepared_statements', dict()))
+	return prepared_config
+
+def should_prepare(sql, threshold):
+	'''
+	Count an execution of `sql` and return whether it has been executed
+	`threshold` times or more.
+	'''
+	if sql in _unpreparable:
+		return False
+
+	with _counts_lock:
+		if len(_execution_counts) >= _max_tracked and \
+				sql not in _execution_counts:
+			_execution_counts.clear()
+		count = _execution_counts.get(sql, 0) + 1
+		_execution_counts[sql] = count
+	return count >= threshold
+
+def mark_unpreparable(sql):
+	'''Prevent further attempts to prepare `sql`.'''
+	_unpreparable.add(sql)
+
+def parameterize(sql):
+	'''
+	Return `sql` with psycopg2 placeholders replaced by positional parameters,
+	suitable for a `PREPARE` body.
+	'''
+	index = 0
+	def replace(match):
+		nonlocal index
+		if match.group(1) == '%':
+			return '%'
+		index += 1
+		return '$%d'%index
+	return _placeholder_regex.sub(replace, sql)
+
+class PreparedStatements:
+	'''
+	The registry of statements prepared on a single connection. Instances are
+	owned by `PooledConnection`s since prepared statements share the lifetime
+	of the connection.
+	'''
+
+	def __init__(self, max_size):
+		'''::max_size The maximum number of statements to keep prepared.'''
+		self.max_size = max_size
+		self.names = OrderedDict()
+		self.next_id = 0
+
+	def get(self, sql):
+		'''Return the name of the statement prepared for `sql`, or `None`.'''
+		name = self.names.get(sql)
+		if name is not None:
+			self.names.move_to_end(sql)
+		return name
+
+	def create_name(self):
+		'''Return a new, connection-unique statement name.'''
+		self.next_id += 1
+		return '_cv_p%d'%self.next_id
+
+	def add(self, sql, name):
+		'''
+		Register `name` as prepared for `sql`. Return the name of an evicted
+		statement that must be deallocated, or `None`.
+		'''
+		self.names[sql] = name
+		if len(self.names) > self.max_size:
+			return self.names.popitem(last=False)[1]
+		return None
@@ -3,7 +3,8 @@
 Relational property API.
 '''
 
-from .ast import nodeify
+from ...exceptions import InvalidQuery
+from .ast import Group, nodeify
 from .dictizations import dictized_property
 from .columns import ForeignKeyColumnType
 
@@ -47,6 +48,69 @@ class RelationSpec:
 				if check_column is typ.target:
 					return column, True
 
+	def key_columns(self, source):
+		'''
+		Return the column of `source` and the column of the target whose 
+		values relate a source model to target models, and whether the 
+		relation is one-to-many.
+		'''
+		link, one_to_many = self.find_link_column(source)
+		if one_to_many:
+			return link.type.target, link, True
+		return link, link.type.target, False
+
+def prefetch(models, *relations):
+	'''
+	Load the relational properties named `relations` for each of `models` with
+	a single query per relation, rather than one query per model on first 
+	access. All models must be of the same class and loaded by the same 
+	session. Return `models`.
+	::models A list of loaded models.
+	::relations The names of the relational properties to load.
+	'''
+	models = [model for model in models if model is not None]
+	if not models:
+		return models
+
+	model_cls = models[0].__class__
+	source, session = model_cls.__table__, models[0].__session__
+	for relation in relations:
+		relation_spec = RelationSpec.get(model_cls.__name__, relation)
+		if not relation_spec:
+			raise InvalidQuery('No relation %s on %s'%(
+				relation, model_cls.__name__
+			))
+		source_column, target_column, one_to_many = \
+				relation_spec.key_columns(source)
+
+		#	Load all related models at once.
+		keys = list(set(
+			source_column.value_on(model) for model in models
+		) - {None})
+		results = list()
+		if keys:
+			#	Group the condition, which may contain disjunctions.
+			condition = Group(relation_spec.condition) & \
+					target_column.is_one_of(*keys)
+			results = session.query(
+				relation_spec.target_gen(), condition, 
+				order=relation_spec.order
+			)
+
+		#	Group the related models by key and assign them.
+		grouped = dict()
+		for result in results:
+			grouped.setdefault(target_column.value_on(result), list()).append(
+				result
+			)
+		for model in models:
+			related = grouped.get(source_column.value_on(model), list())
+			if not one_to_many:
+				related = related[0] if related else None
+			setattr(model, relation_spec.attr, related)
+	
+	return models
+
 def relational_property(*args, **kwargs):
 	def relational_property_inner(meth):
 		safe_key = ''.join(('__', meth.__name__))
@@ -61,19 +125,8 @@ def relational_property(*args, **kwargs):
 			if existing is not _meta_null:
 				return existing
 			else:
-				table = self.__class__.__table__
-				link, one_to_many = relation_spec.find_link_column(table)
-
-				if one_to_many:
-					cond = relation_spec.condition & (link == link.type.target.value_on(self))
-				else:
-					cond = relation_spec.condition & (link.type.target == link.value_on(self))
-
-				result = self.__session__.query(relation_spec.target_gen(), 
-						cond,
-						order=relation_spec.order, one=not one_to_many)
-				setattr(self, safe_key, result)
-				return result
+				prefetch((self,), meth.__name__)
+				return getattr(self, safe_key)
 
 		meth_replacement.__name__ = meth.__name__
 		
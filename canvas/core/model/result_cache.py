@@ -0,0 +1,186 @@
+# coding: utf-8
+'''
+The process-wide query result cache. The raw rows of opted-in queries are
+cached against their compiled SQL and values, and entries are invalidated by
+per-table version counters that sessions bump as they write.
+'''
+
+import sys
+import copy
+
+from threading import Lock
+from collections import OrderedDict
+
+from ...configuration import config
+from .ast import Aggregation
+from .tables import Table
+from .joins import Join
+from .type_adapters import ArrayParameter
+
+#	The result cache configuration used when the `database.result_cache`
+#	section is omitted.
+_default_result_cache_config = {
+	'max_bytes': 64*1024*1024
+}
+
+def result_cache_config():
+	'''Return the result cache configuration with defaults applied.'''
+	result_cache_config = dict(_default_result_cache_config)
+	result_cache_config.update(config.database.get('result_cache', dict()))
+	return result_cache_config
+
+def selected_tables(target_node):
+	'''Return a tuple of the tables selected from by `target_node`.'''
+	if isinstance(target_node, Join):
+		return tuple(
+			table for child in (target_node.source, *target_node.dests)
+				for table in selected_tables(child)
+		)
+	if isinstance(target_node, Aggregation):
+		return (target_node.source.table,)
+	if isinstance(target_node, Table):
+		return (target_node,)
+	return (target_node.table,)
+
+def result_key(sql, values):
+	'''
+	Return the cache key of the statement `sql` with `values`, or `None` if
+	the values aren't hashable.
+	'''
+	key = (sql, tuple(
+		tuple(value.values) if isinstance(value, ArrayParameter) else value
+			for value in values
+	))
+	try:
+		hash(key)
+	except TypeError:
+		return None
+	return key
+
+def rows_size(rows):
+	'''Return an estimate of the memory used by the list of rows `rows`.'''
+	size = sys.getsizeof(rows)
+	for row in rows:
+		size += sys.getsizeof(row) + sum(
+			sys.getsizeof(value) for value in row
+		)
+	return size
+
+class ResultCache:
+	'''
+	A bounded, least-recently-used cache of query result rows. Each entry
+	records the versions of the tables it was selected from, and is only
+	returned while none of them have changed.
+	'''
+
+	def __init__(self, max_bytes):
+		'''::max_bytes The estimated memory budget of cached rows.'''
+		self.max_bytes, self.size = max_bytes, 0
+		self.entries = OrderedDict()
+		#	A map of table name to version. Versions are read without the lock
+		#	since dictionary lookups are atomic.
+		self.versions = dict()
+		self.hits = self.misses = 0
+		self.lock = Lock()
+
+	def table_versions(self, tables):
+		'''Return a tuple of the current versions of `tables`.'''
+		return tuple(self.versions.get(table.name, 0) for table in tables)
+
+	def bump(self, *tables):
+		'''Invalidate all entries selected from any of `tables`.'''
+		self.invalidate(*(table.name for table in tables))
+
+	def invalidate(self, *names):
+		'''Invalidate all entries selected from any of the tables `names`.'''
+		with self.lock:
+			for name in names:
+				self.versions[name] = self.versions.get(name, 0) + 1
+
+	def get(self, key, tables):
+		'''
+		Return the rows cached for `key` if they were selected from the current
+		versions of `tables`, or `None`.
+		'''
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None and entry[0] != self.table_versions(tables):
+				#	Discard the stale entry.
+				self.discard(key)
+				entry = None
+			
+			if entry is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			self.entries.move_to_end(key)
+		
+		versions, rows, size, mutable = entry
+		if mutable:
+			#	Don't share mutable values between the models loaded from 
+			#	this entry.
+			rows = [
+				tuple(
+					copy.deepcopy(value) if isinstance(value, (dict, list)) 
+						else value for value in row
+				) for row in rows
+			]
+		return rows
+
+	def put(self, key, versions, rows):
+		'''
+		Cache `rows` for `key`, as selected from tables at `versions`,
+		evicting the least recently used entries to remain within budget.
+		'''
+		size = rows_size(rows)
+		if size > self.max_bytes:
+			return
+		mutable = any(
+			isinstance(value, (dict, list)) for row in rows for value in row
+		)
+
+		with self.lock:
+			self.discard(key)
+			self.entries[key] = (versions, rows, size, mutable)
+			self.size += size
+			while self.size > self.max_bytes:
+				self.discard(next(iter(self.entries)))
+
+	def discard(self, key):
+		'''Remove the entry for `key`, if any. The caller must hold the lock.'''
+		entry = self.entries.pop(key, None)
+		if entry is not None:
+			self.size -= entry[2]
+
+	def stats(self):
+		'''
+		Return a dictionary containing hit, miss, entry count, and byte size
+		counters.
+		'''
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'size': len(self.entries),
+			'bytes': self.size
+		}
+
+	def clear(self):
+		'''Empty this cache and reset its counters.'''
+		with self.lock:
+			self.entries.clear()
+			self.size = self.hits = self.misses = 0
+
+#	The process-wide result cache, created on first use.
+_result_cache = None
+_result_cache_lock = Lock()
+
+def get_result_cache():
+	'''Return the process-wide result cache, creating it if required.'''
+	global _result_cache
+	if _result_cache is None:
+		with _result_cache_lock:
+			if _result_cache is None:
+				_result_cache = ResultCache(
+					result_cache_config()['max_bytes']
+				)
+	return _result_cache
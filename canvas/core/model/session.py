@@ -6,17 +6,31 @@ The `Session` class definition.
 import sqlparse
 
 from collections import OrderedDict
-from psycopg2 import IntegrityError, connect
+from psycopg2 import IntegrityError, Error as DatabaseError
+from psycopg2.errorcodes import IN_FAILED_SQL_TRANSACTION
 
-from ...exceptions import ValidationErrors, Frozen
+from ...exceptions import ValidationErrors, Frozen, InvalidQuery
 from ...configuration import config
 from ...utils import logger
-from .ast import Literal, Aggregation, deproxy
+from .ast import Literal, Clause, Group, Aggregation, Projection, Seek, \
+	deproxy
 from .constraints import Constraint
 from .columns import Column
+from .tables import Table
 from .joins import Join
 from .statements import InsertStatement, CreateStatement, UpdateStatement, \
-	DeleteStatement, SelectStatement
+	DeleteStatement, SelectStatement, BulkInsertStatement, BulkUpdateStatement
+from .bulk import bulk_config, is_copyable, copy_buffer
+from .pool import get_pool, get_replica_pool, get_replica_pools
+from .identity import IdentityMap, identity_key
+from .validation import ValidationPlan
+from .pagination import keyset_order, encode_cursor, decode_cursor
+from .relationalism import prefetch as prefetch_relations
+from .result_cache import get_result_cache, selected_tables, result_key
+from .invalidation import invalidation_config, emit_invalidations, \
+	ensure_listener
+from .prepared import PreparedStatements, prepared_config, should_prepare, \
+	mark_unpreparable, parameterize
 from . import _sentinel
 
 log = logger(__name__)
@@ -26,193 +40,638 @@ class Session:
 	The `Session` class is used for database interaction and, transparently, 
 	model management. Request context's contain a `Session` by default. 
 	'''
+	#	A counter used to name server-side cursors uniquely.
+	stream_count = 0
 
-	def __init__(self):
-		'''Create a new session. Use `create_session` instead.'''
-		self._connection = self._cursor = None
-		#	A dictionary for storing all actively loaded models. Keys are
-		#	of the format <host table name>=><primary key value>.
-		self.loaded_models = dict()
+	def __init__(self, max_dirty=None):
+		'''
+		Create a new session. Use `create_session` instead.
+		::max_dirty The number of dirty models after which pending updates
+			are flushed to the database, or `None`.
+		'''
+		self._pooled = self._connection = self._cursor = None
+		#	The replica connection, checked out for the first routed read.
+		self._replica_pooled = self._replica_cursor = None
+		#	Whether reads are currently being routed to the replica, whether
+		#	the primary has an open transaction, and whether all reads have 
+		#	been pinned to the primary.
+		self.reading = self.writing = self.primary_only = False
+		#	The set of tables written in the current transaction.
+		self.written_tables = set()
+		#	The identity map of all actively loaded models. Clean models are
+		#	only weakly referenced by it.
+		self.loaded_models = IdentityMap()
+		self.max_dirty = max_dirty
 		#	A flag for freezing database interaction (causing SQL emission) to
 		#	raise an exception. Used primarily for grey-box testing.
 		self.frozen = False
+		#	The prepared statement policy.
+		self.prepare_policy = prepared_config()
 
 	@property
 	def connection(self):
-		'''The connection property allowing lazy actualization.'''
+		'''
+		The connection property allowing lazy actualization. Connections are 
+		checked out of the process-wide pool, or a replica pool while reads 
+		are routed to a replica.
+		'''
+		if self.reading:
+			if not self._replica_pooled:
+				self._replica_pooled = get_replica_pool().checkout()
+			return self._replica_pooled.connection
+
 		if not self._connection:
-			#	Create the connection.
-			self._connection = connect(
-				database=	config.database.database,
-				user=		config.database.user,
-				password=	config.database.password,
-				host=		config.database.host
-			)
+			#	Check out a connection.
+			self._pooled = get_pool().checkout()
+			self._connection = self._pooled.connection
 		
 		return self._connection
 	
 	@property
 	def cursor(self):
 		'''The cursor property allowing lazy actualization.'''
+		if self.reading:
+			if not self._replica_cursor:
+				self._replica_cursor = self.connection.cursor()
+			return self._replica_cursor
+
 		if not self._cursor:
 			self._cursor = self.connection.cursor()
 
 		return self._cursor
 
+	@property
+	def prepared_statements(self):
+		'''The prepared statement registry of the active connection.'''
+		#	Ensure a connection is checked out.
+		self.connection
+		
+		pooled = self._replica_pooled if self.reading else self._pooled
+		if pooled.prepared is None:
+			pooled.prepared = PreparedStatements(
+				self.prepare_policy['max_per_connection']
+			)
+		
+		return pooled.prepared
+
+	def use_primary(self, primary_only=True):
+		'''
+		Pin all reads of this session to the primary database, so that they 
+		observe writes that may not yet have been replicated.
+		::primary_only Whether to pin reads, or `False` to resume routing.
+		'''
+		self.primary_only = primary_only
+		return self
+
+	def reads_from_replica(self, for_update=False, for_share=False):
+		'''
+		Return whether the routing policy permits a read to be served by a 
+		replica; it doesn't lock rows, reads aren't pinned to the primary,
+		and the primary has no open transaction or dirty models that the read
+		should observe.
+		'''
+		return not (
+			for_update or for_share or self.primary_only or self.writing or
+				self.loaded_models.dirty
+		)
+
+	def route_read(self, for_update=False, for_share=False):
+		'''
+		Begin routing reads to a replica if one is configured and the routing
+		policy permits it. Return whether reads were already being routed, to
+		be passed to `end_read`.
+		'''
+		previous = self.reading
+		if not previous and self.reads_from_replica(for_update, for_share):
+			self.reading = bool(get_replica_pools())
+		return previous
+
+	def end_read(self, previous):
+		'''Restore the routing state returned by `route_read`.'''
+		self.reading = previous
+
 	def assign_row_to_model(self, model, row_segment):
 		'''Assign `model` with the values contained in `row_segment`.'''
-		#	Assign column values.
-		table = model.__class__.__table__
-		for i, column in enumerate(table.get_columns()):
-			setattr(model, column.name, row_segment[i])
+		#	Assign column values, bypassing dirty tracking.
+		model.__hydrate__(row_segment)
 
 		#	Invoke load callback.
 		model.__loaded__(self)
 
-		#	Track this model.
-		row_reference = '=>'.join((
-			table.name, str(table.primary_key.value_on(model))
-		))
-		self.loaded_models[row_reference] = model
+		#	Track this model. The primary key is the first column.
+		self.loaded_models.add((model.__table__, row_segment[0]), model)
 
-	def precheck_constraints(self, model):
+	def mark_dirty(self, model):
 		'''
-		Precheck all constraints in the schema of `model` for violations,
-		raising an `UnprocessableEntity` exception if any exist.
+		Retain the loaded model `model`, which has become dirty, until it's
+		updated. If more than `max_dirty` models are retained, pending updates
+		are flushed.
 		'''
-		error_dict, error_summary = dict(), None
-		table = model.__class__.__table__
+		self.loaded_models.mark_dirty(model)
+		if self.max_dirty and len(self.loaded_models.dirty) > self.max_dirty:
+			self.flush()
 
-		#	Check column level constraints
-		for column in table.columns.values():
-			value = getattr(model, column.name)
-			if value is _sentinel:
-				#	The model was just created and this attribute hasn't been 
-				#	initialized yet.
-				continue
-			
-			#	Check this column's constraints.
-			for constraint in column.constraints:
-				try:
-					if constraint.precheck_violation(model, value):
-						error_dict[column.name] = constraint.error_message
-						break
-				except NotImplementedError:
-					pass
-		
-		#	Check table level constraints.
-		for constraint in table.constraints:
-			try:
-				if constraint.precheck_violation(model, value):
-					error_summary = constraint.error_message
-					break
-			except NotImplementedError:
-				pass
+	def validate(self, models):
+		'''
+		Precheck the constraints of `models`, which may be of several tables, 
+		for violations in batches with each table's `ValidationPlan`. Return a
+		dictionary mapping the index of each violating model to a
+		`ValidationErrors` describing its violations.
+		'''
+		#	Group model indices by table.
+		by_table = OrderedDict()
+		for i, model in enumerate(models):
+			by_table.setdefault(model.__table__, list()).append(i)
 
-		if error_dict or error_summary:
-			#	Violations were found.
-			raise ValidationErrors(error_dict, error_summary)
+		violations = dict()
+		for table, indices in by_table.items():
+			plan = ValidationPlan.get(table)
+			found = plan.validate([models[i] for i in indices])
+			for j, errors in found.items():
+				violations[indices[j]] = errors
+		return violations
+
+	def precheck_constraints(self, *models):
+		'''
+		Precheck all constraints in the schema of `models` for violations,
+		raising the `ValidationErrors` of the first violating model if any 
+		exist.
+		'''
+		violations = self.validate(models)
+		if violations:
+			raise violations[min(violations)]
 
 	def load_model_instance(self, model_cls, row_segment):
 		'''Load an instance of `model_cls` from `row_segment`.'''
 		if not row_segment:
 			return None
 		
-		#	Create a row reference for this row and check if a model is 
-		#	already loaded for that row.
-		row_reference = '=>'.join((
-			model_cls.__table__.name, str(row_segment[0])
-		))
-		is_remap = row_reference in self.loaded_models
+		#	Check if a model is already loaded for this row.
+		model = self.loaded_models.get((model_cls.__table__, row_segment[0]))
 
-		if is_remap:
-			#	Re-use the existing model.
-			model = self.loaded_models[row_reference]
-		else:
+		if model is None:
 			#	Backdoor a new instance.
 			model = model_cls.__new__(model_cls)
-			model.__dirty__ = dict()
 		
 		#	Assign the values and return.
 		self.assign_row_to_model(model, row_segment)
 		return model
 
-	def execute(self, sql, values=tuple()):
+	def load_lazy(self, models, *columns):
+		'''
+		Load the values of the lazy-loaded `columns` for each of `models` with a
+		single query, rather than one query per model and column on access. 
+		Models for which a column is already loaded are unaffected. Return 
+		`models`.
+		::models A list of loaded models of the same class.
+		::columns The columns to load.
+		'''
+		models = [model for model in models if model is not None]
+		if not models or not columns:
+			return models
+		
+		table = models[0].__class__.__table__
+		columns = [deproxy(column) for column in columns]
+		#	Only load the models missing a value.
+		unloaded = dict()
+		for model in models:
+			if any(
+				model.__value__(column.name, _sentinel) is _sentinel 
+					for column in columns
+			):
+				unloaded[table.primary_key.value_on(model)] = model
+		if not unloaded:
+			return models
+
+		rows = self.rows(
+			(table.primary_key, *columns), 
+			table.primary_key.is_one_of(*unloaded.keys())
+		)
+		for row in rows:
+			model = unloaded[row[0]]
+			#	Assign without dirtying, preserving unflushed assignments.
+			for column, value in zip(columns, row[1:]):
+				if model.__value__(column.name, _sentinel) is _sentinel:
+					object.__setattr__(model, column.name, value)
+		return models
+
+	def execute(self, sql, values=tuple(), cursor=None):
 		'''
 		Execute a prepared statement with constraint violation identification.
+		::cursor The cursor with which to execute, if not the session cursor.
 		'''
 		if self.frozen:
 			raise Frozen()
+		if cursor is None:
+			cursor = self.cursor
+		if not self.reading:
+			#	Subsequent reads should observe this transaction.
+			self.writing = True
 
 		if config.development.log_emitted_sql:
 			#	Log the prepared statement.
 			#	TODO: TF going on with CREATE statements - they format bad.
-			sql_str = self.cursor.mogrify(sql, values if values else tuple()).decode()
+			sql_str = cursor.mogrify(sql, values if values else tuple()).decode()
 			if not sql_str.startswith('CREATE'):
 				sql_str = sqlparse.format(sql_str, reindent=True, truncate_strings=100)
 			log.debug('\n'.join(('Emitting: ', sql_str)).replace('\n', '\n\t'))
 		try:
-			self.cursor.execute(sql, values)
+			cursor.execute(sql, values)
 		except IntegrityError as ex:
-			#	Retrieve the violated constraint.
-			constraint = Constraint.get(ex.diag.constraint_name)
-			if not constraint:
-				#	TODO: Some cases are not yet handled.
-				raise NotImplementedError() from ex
-			
-			if isinstance(constraint.host, Column):
-				#	The violation occured against a given column.
-				raise ValidationErrors({
-					constraint.host.name: constraint.error_message
-				}) from None
-			else:
-				#	Table-level violation.
-				raise ValidationErrors(summary=constraint.error_message) \
-					from None
+			self.raise_violation(ex)
 		
 		#	Chain.
 		return self
 
-	def execute_statement(self, statement):
-		'''Execute a `Statement` object.'''
-		sql, values = statement.write()
+	def raise_violation(self, ex):
+		'''
+		Raise the `ValidationErrors` corresponding to the `IntegrityError` 
+		`ex`.
+		'''
+		#	Retrieve the violated constraint.
+		constraint = Constraint.get(ex.diag.constraint_name)
+		if not constraint:
+			#	TODO: Some cases are not yet handled.
+			raise NotImplementedError() from ex
+		
+		if isinstance(constraint.host, Column):
+			#	The violation occured against a given column.
+			raise ValidationErrors({
+				constraint.host.name: constraint.error_message
+			}) from None
+		else:
+			#	Table-level violation.
+			raise ValidationErrors(summary=constraint.error_message) \
+				from None
+
+	def prepare(self, sql):
+		'''
+		Prepare `sql` on the active connection, returning the name of the 
+		prepared statement or `None` if Postgres refused to prepare it.
+		'''
+		if self.frozen:
+			raise Frozen()
+		
+		registry = self.prepared_statements
+		name = registry.create_name()
+		prepare_sql = ' '.join(('PREPARE', name, 'AS', parameterize(sql), ';'))
+		if self.connection.autocommit:
+			#	There's no transaction to protect, and savepoints are 
+			#	unavailable outside of one.
+			try:
+				self.cursor.execute(prepare_sql)
+			except DatabaseError:
+				log.debug('Statement not preparable: %s', sql)
+				mark_unpreparable(sql)
+				return None
+		else:
+			try:
+				#	Prepare within a savepoint so a failure doesn't abort the
+				#	active transaction.
+				self.cursor.execute(' '.join((
+					'SAVEPOINT _cv_prepare;', prepare_sql,
+					'RELEASE SAVEPOINT _cv_prepare;'
+				)))
+			except DatabaseError as ex:
+				if ex.pgcode == IN_FAILED_SQL_TRANSACTION:
+					#	The transaction was already aborted, so the savepoint
+					#	wasn't created and the statement isn't at fault.
+					raise
+				self.cursor.execute(
+					'ROLLBACK TO SAVEPOINT _cv_prepare; '
+					'RELEASE SAVEPOINT _cv_prepare;'
+				)
+				log.debug('Statement not preparable: %s', sql)
+				mark_unpreparable(sql)
+				return None
+
+		#	Register the statement, deallocating any it displaces.
+		evicted = registry.add(sql, name)
+		if evicted:
+			self.cursor.execute('DEALLOCATE %s;'%evicted)
+		return name
+
+	def execute_statement(self, statement, written=None):
+		'''
+		Execute a `Statement` object, via a server-side prepared statement if
+		prepared statements are enabled and it's executed frequently.
+		::written The SQL, value list tuple of `statement`, if already written.
+		'''
+		sql, values = written or statement.write()
+		if statement.preparable and self.prepare_policy['enabled']:
+			name = self.prepared_statements.get(sql)
+			if name is None and should_prepare(
+				sql, self.prepare_policy['threshold']
+			):
+				name = self.prepare(sql)
+			
+			if name:
+				sql = 'EXECUTE %s'%name
+				if values:
+					sql = '%s(%s)'%(sql, ', '.join(('%s',)*len(values)))
+		
 		self.execute(sql + ';', values)
 
+	def wrote(self, *tables):
+		'''
+		Record that `tables` have been written in the current transaction,
+		invalidating their cached query results.
+		'''
+		get_result_cache().bump(*tables)
+		self.written_tables.update(tables)
+
+	def cached_rows(self, statement, target, cache):
+		'''
+		Return the rows selected by `statement` from the result cache, 
+		executing it and caching the rows on a miss, or `None` if its results
+		aren't cached. Results aren't cached for tables this session has 
+		written in the current transaction, and rows read from a replica 
+		aren't cached since it may lag behind the table versions.
+		::target The selection target of `statement`.
+		::cache Whether to cache the results, or `None` to cache them only if
+			all selected models cache results by default.
+		'''
+		if cache is False:
+			return None
+		tables = selected_tables(self.resolve_target(target))
+		if cache is None and not all(table.cache_results for table in tables):
+			return None
+		if any(table in self.written_tables for table in tables):
+			return None
+		
+		written = statement.write()
+		key = result_key(*written)
+		if key is None:
+			return None
+		
+		result_cache = get_result_cache()
+		rows = result_cache.get(key, tables)
+		if rows is None:
+			#	Retrieve versions first so concurrent writes leave the entry 
+			#	stale.
+			versions = result_cache.table_versions(tables)
+			self.execute_statement(statement, written)
+			rows = self.cursor.fetchall()
+			if not self.reading:
+				result_cache.put(key, versions, rows)
+		return rows
+
+	def track_saved(self, model, resultant_id):
+		'''Assign `resultant_id` to the newly inserted `model` and track it.'''
+		table = model.__class__.__table__
+		#	TODO: Handle other in-database defaults.
+		table.primary_key.set_value_on(model, resultant_id)
+		self.loaded_models.add((table, resultant_id), model)
+		model.__loaded__(self)
+
 	def save(self, *models):
-		'''Save `models` to the database.'''
+		'''
+		Save `models` to the database. Consecutive models of the same table
+		are inserted in bulk; with a multi-row `INSERT` per batch or, for very
+		large runs, with `COPY`.
+		'''
+		policy = bulk_config()
+
+		#	Partition into consecutive runs of the same table, so that 
+		#	insertion order across tables is preserved.
+		runs = list()
 		for model in models:
 			table = model.__class__.__table__
-
+			if runs and runs[-1][0] is table:
+				runs[-1][1].append(model)
+			else:
+				runs.append((table, [model]))
+		
+		for table, run in runs:
 			#	Precheck for violations.
-			self.precheck_constraints(model)
+			self.precheck_constraints(*run)
+			self.wrote(table)
+
+			if len(run) == 1:
+				self.insert_one(table, run[0])
+			elif len(run) >= policy['copy_threshold'] and \
+					self.copy_insert(table, run):
+				pass
+			else:
+				batch_size = policy['batch_size']
+				for i in range(0, len(run), batch_size):
+					self.bulk_insert(table, run[i:i + batch_size])
+		return self
+
+	def insert_one(self, table, model):
+		'''Insert a single model with an `InsertStatement`.'''
+		#	Collect values, ignoring sentinels which may be in-database
+		#	defaults.
+		to_insert = list()
+		for column in table.columns.values():
+			value = column.insert_value_on(model)
+			if value is not _sentinel:
+				to_insert.append((value, column))
+		
+		#	Create and execute an insert statement, then re-load the result ID 
+		#	onto the model.
+		self.execute_statement(InsertStatement(table, to_insert))
+		self.track_saved(model, self.cursor.fetchone()[0])
+
+	def insert_rows(self, table, models):
+		'''
+		Return a list of the columns for which any of `models` has a value, 
+		and a list of value lists for those columns. Sentinels in the value
+		lists are inserted as the in-database default.
+		'''
+		rows = [
+			[
+				column.insert_value_on(model) 
+					for column in table.columns.values()
+			] for model in models
+		]
+		included = [
+			i for i in range(len(table.columns)) 
+				if any(row[i] is not _sentinel for row in rows)
+		]
+		columns = list(table.columns.values())
 
-			#	Collect values, ignoring sentinels which may be in-database
-			#	defaults.
-			to_insert = list()
-			for column in table.columns.values():
-				value = getattr(model, column.name)
-				if value is not _sentinel:
-					to_insert.append((value, column))
+		return (
+			[columns[i] for i in included], 
+			[[row[i] for i in included] for row in rows]
+		)
+
+	def bulk_insert(self, table, models):
+		'''Insert `models` with a single multi-row `INSERT` statement.'''
+		columns, rows = self.insert_rows(table, models)
+
+		self.execute_statement(BulkInsertStatement(table, columns, rows))
+		#	Generated keys are returned in insertion order.
+		for model, result in zip(models, self.cursor.fetchall()):
+			self.track_saved(model, result[0])
+
+	def upsert(self, *models, conflict=None, update=None):
+		'''
+		Insert `models` or, where a row with the same values in the `conflict`
+		columns exists, update that row instead, with an `INSERT ... ON 
+		CONFLICT` statement per batch. The primary keys of the inserted or
+		updated rows are assigned back onto the models, but other columns that
+		weren't updated retain their values on the model. Of models sharing
+		values in the `conflict` columns, only the last is written.
+		::conflict The columns of a unique constraint or index that identify
+			conflicting rows. Defaults to the primary key.
+		::update The columns to assign from the models on conflict. Defaults
+			to all inserted columns other than the primary key and those in
+			`conflict`. If empty, conflicting rows are left unchanged.
+		'''
+		if not models:
+			return self
+		
+		table = models[0].__class__.__table__
+		for model in models:
+			if model.__class__.__table__ is not table:
+				raise InvalidQuery('Upserted models span multiple tables')
+		
+		#	Resolve the conflict and update columns.
+		if conflict is None:
+			conflict = (table.primary_key,)
+		conflict = [deproxy(column) for column in conflict]
+		if update is not None:
+			update = [deproxy(column) for column in update]
+		for column in (*conflict, *(update or tuple())):
+			if column.table is not table:
+				raise InvalidQuery('Upsert column %s is not of %s'%(
+					column.name, table.name
+				))
+		
+		#	Precheck for violations.
+		self.precheck_constraints(*models)
+		self.wrote(table)
+
+		#	A statement can't update the same row twice, so only the last of
+		#	the models sharing conflict values is issued.
+		def conflict_key(model):
+			key = tuple(column.insert_value_on(model) for column in conflict)
+			try:
+				hash(key)
+			except TypeError:
+				return id(model)
+			if any(value is _sentinel for value in key):
+				return id(model)
+			return key
+		upserted = [(conflict_key(model), model) for model in models]
+		issued = OrderedDict(upserted)
+		models = tuple(issued.values())
+
+		batch_size = bulk_config()['batch_size']
+		for i in range(0, len(models), batch_size):
+			batch = models[i:i + batch_size]
+			columns, rows = self.insert_rows(table, batch)
 			
-			#	Create and execute an insert statement.
-			self.execute_statement(
-				InsertStatement(model.__class__, to_insert)
-			)
-			#	Re-load the result ID onto the model.
-			#	TODO: Handle other in-database defaults.
-			resultant_id = self.cursor.fetchone()[0]
-			table.primary_key.set_value_on(model, resultant_id)
-			self.loaded_models['=>'.join((table.name, str(resultant_id)))] = model
-			model.__loaded__(self)
+			batch_update = update
+			if batch_update is None:
+				batch_update = [
+					column for column in columns 
+						if column is not table.primary_key and not any(
+							column is conflict_column 
+								for conflict_column in conflict
+						)
+				]
+			
+			#	Single rows are upserted with a cachable statement.
+			if len(batch) == 1:
+				statement = InsertStatement(
+					table, list(zip(rows[0], columns)), conflict, 
+					batch_update
+				)
+			else:
+				statement = BulkInsertStatement(
+					table, columns, rows, conflict, batch_update
+				)
+			self.execute_statement(statement)
+			
+			#	Keys are returned in insertion order.
+			for model, result in zip(batch, self.cursor.fetchall()):
+				self.track_saved(model, result[0])
+		
+		#	Assign the keys of the rows that shadowed models were upserted as.
+		for key, model in upserted:
+			issued_model = issued[key]
+			if issued_model is not model:
+				table.primary_key.set_value_on(
+					model, table.primary_key.value_on(issued_model)
+				)
 		return self
 
+	def copy_insert(self, table, models):
+		'''
+		Insert `models` by streaming them through `COPY FROM STDIN`, returning
+		`False` without emitting SQL if they aren't suitable for it. Primary 
+		keys generated by sequences are allocated beforehand so they can be
+		assigned back onto the models.
+		'''
+		columns = list(table.columns.values())
+		rows = [
+			[column.insert_value_on(model) for column in columns] 
+				for model in models
+		]
+
+		#	The primary key is the first column.
+		allocate_keys = rows[0][0] is _sentinel
+		#	COPY can't mix defaults and values within a column.
+		included = list()
+		for i in range(len(columns)):
+			defaulted = [row[i] is _sentinel for row in rows]
+			if i == 0 and allocate_keys:
+				if not all(defaulted):
+					return False
+				included.append(i)
+			elif not any(defaulted):
+				included.append(i)
+			elif not all(defaulted):
+				return False
+		for row in rows:
+			for i in included:
+				if not (i == 0 and allocate_keys) and not is_copyable(row[i]):
+					return False
+		
+		if self.frozen:
+			raise Frozen()
+
+		if allocate_keys:
+			#	Allocate keys from the primary key's sequence, if it has one.
+			self.execute(
+				'SELECT pg_get_serial_sequence(%s, %s);', 
+				(table.name, table.primary_key.name)
+			)
+			sequence = self.cursor.fetchone()[0]
+			if not sequence:
+				return False
+			self.execute(
+				'SELECT nextval(%s) FROM generate_series(1, %s);',
+				(sequence, len(rows))
+			)
+			for row, result in zip(rows, self.cursor.fetchall()):
+				row[0] = result[0]
+		
+		sql = 'COPY %s (%s) FROM STDIN'%(
+			table.name, ', '.join(columns[i].name for i in included)
+		)
+		if config.development.log_emitted_sql:
+			log.debug('Emitting: \n\t%s (%d rows)', sql, len(rows))
+		#	COPY bypasses `execute`, so record the write here.
+		self.writing = True
+		self.wrote(table)
+		try:
+			self.cursor.copy_expert(sql, copy_buffer(
+				[row[i] for i in included] for row in rows
+			))
+		except IntegrityError as ex:
+			self.raise_violation(ex)
+
+		for model, row in zip(models, rows):
+			self.track_saved(model, row[0])
+		return True
+
 	def detach(self, model):
 		'''Detach an object from its mapped row.'''
-		table = model.__class__.__table__
 		#	Delete the entry.
-		del self.loaded_models[
-			'=>'.join([table.name, str(table.primary_key.value_on(model))])
-		]
+		self.loaded_models.remove(identity_key(model))
 		#	Inform the model.
 		model.__loaded__(None)
 
@@ -222,6 +681,7 @@ class Session:
 		'''Delete each of `models` from the database.'''
 		for model in models:
 			table = model.__class__.__table__
+			self.wrote(table)
 			#	Create and execute a delete statement.
 			condition = table.primary_key == table.primary_key.value_on(model)
 			self.execute_statement(DeleteStatement(table, condition, cascade))
@@ -230,107 +690,439 @@ class Session:
 
 		return self
 
-	#	TODO: Modifiers need to honour name policy.
-	def query(self, target, condition=True, one=False, count=None, 
-				offset=None, distinct=False, order=tuple(), for_update=False, 
-				for_share=False):
-		'''
-		Query the database, returning loaded models.
-		::condition A flag-like AST node representing the query condition.
-		::one Whether to retrieve a single entry or a list.
-		::count The number of entries to retrieve.
-		::offest The offset at which to begin.
-		::distinct Whether to only retrieve distinct entries.
-		::order One or more ordering directive generated by the `Column.asc` or 
-			`Column.desc` methods.
-		::for_update Whether all selections should be `FOR UPDATE`.
-		::for_share Whether all selections should be `FOR SHARE`.
-		'''
-		#	Resolve to the table or joinable target node.
+	def resolve_target(self, target):
+		'''Return the table or joinable node that `target` selects from.'''
 		target_node = deproxy(target)
-		if isinstance(target_node, Column):
+		if isinstance(target_node, (Column, Projection)):
 			target_node = target_node.table
+		return target_node
+
+	def resolve_keyset_table(self, target_node):
+		'''
+		Return the table whose models are loaded from `target_node`, by which
+		results are paginated.
+		'''
 		if isinstance(target_node, Join):
-			target_node.set_name('_t')
+			return target_node.source
+		return target_node
+
+	#	TODO: Modifiers need to honour name policy.
+	def create_select(self, target, condition=True, count=None, offset=None, 
+				distinct=False, order=tuple(), for_update=False, 
+				for_share=False, after=None, group_by=tuple(), having=None):
+		'''
+		Return a `SelectStatement` for a query. The parameters are equivalent
+		to those of `query` and `rows`.
+		'''
+		target_node = self.resolve_target(target)
+
+		if after is not None:
+			#	Select the rows following the given order keys.
+			order = keyset_order(self.resolve_keyset_table(target_node), order)
+			if isinstance(after, str):
+				after = decode_cursor(after)
+			if len(after) != len(order):
+				raise InvalidQuery('Keyset pagination key length mismatch')
+			#	Group the condition, which may contain disjunctions.
+			condition = Group(condition) & Seek(order, after)
 
-		if condition is False:
-			#	Nothing would be returned.
-			return None if one else list()
-		#	Process arguments.
-		if isinstance(target, Aggregation):
-			one = True
-		
 		#	Create a list of modifier AST nodes.
 		modifiers = list()
 
 		#	Transform optional arguments to modifiers.
+		if group_by:
+			if not isinstance(group_by, (list, tuple)):
+				group_by = (group_by,)
+			modifiers.append(Literal('GROUP BY', Literal(*(
+				target_node.name_column(deproxy(column)) for column in group_by
+			), joiner=', ')))
+		if having is not None:
+			modifiers.append(Clause('HAVING', having))
 		if order:
 			if not isinstance(order, (list, tuple)):
 				order = (order,)
+			
+			def name_order_item(item):
+				if isinstance(item.column, Aggregation):
+					return item.column.serialize()
+				if isinstance(target_node, Join):
+					return target_node.select_name_column(item.column)
+				return target_node.name_column(item.column)
+
 			modifiers.append(Literal('ORDER BY', Literal(*(
-				' '.join((target_node.name_column(item.column), item.which)) for item in order 
+				' '.join((name_order_item(item), item.which)) for item in order 
 			), joiner=', ')))
 		if count:
-			modifiers.append(Literal('COUNT', count))
+			modifiers.append(Literal('LIMIT', str(int(count))))
 		if offset:
 			modifiers.append(Literal('OFFSET', str(offset)))
 		if for_share or for_update:
 			which = 'SHARE' if for_share else 'UPDATE'
 			modifiers.append(Literal('FOR', which))
 		
-		self.execute_statement(
-			SelectStatement(target, condition, modifiers, distinct)
-		)
+		return SelectStatement(target, condition, modifiers, distinct)
 
-		#	Retrieve a loader and return it's output.
-		loader = deproxy(target)
-		if one:
-			row, host = self.cursor.fetchone(), None
-			if not row:
-				return None
-			
-			pk = row[0]
-			while True:
-				host = loader.load_next(row, self)
+	def query(self, target, condition=True, one=False, count=None, 
+				offset=None, distinct=False, order=tuple(), for_update=False, 
+				for_share=False, prefetch=tuple(), load=tuple(), after=None,
+				cache=None):
+		'''
+		Query the database, returning loaded models.
+		::condition A flag-like AST node representing the query condition.
+		::one Whether to retrieve a single entry or a list.
+		::count The maximum number of rows to retrieve.
+		::offest The offset at which to begin. Prefer `after` for deep 
+			pagination.
+		::distinct Whether to only retrieve distinct entries.
+		::order One or more ordering directive generated by the `Column.asc` or 
+			`Column.desc` methods.
+		::for_update Whether all selections should be `FOR UPDATE`.
+		::for_share Whether all selections should be `FOR SHARE`.
+		::prefetch The names of relational properties of the loaded models to
+			load with a single query each.
+		::load Lazy-loaded columns of the loaded models to load with a single
+			query.
+		::after A cursor token returned by `page`, or the values of the order
+			columns of the last row seen followed by its primary key if the 
+			order doesn't include it. Only rows following it in the order are 
+			selected, with the primary key as a tie-breaker.
+		::cache Whether to serve the rows of this query from the process-wide
+			result cache, or `None` to do so only if all selected models cache
+			results by default. Locking queries are never cached.
+		'''
+		previous = self.route_read(for_update, for_share)
+		try:
+			if isinstance(target, (list, tuple, Projection)):
+				#	Query in rows mode.
+				return self.rows(
+					target, condition, one, False, count, offset, distinct, 
+					order, for_update, for_share, cache=cache
+				)
 
-				row = self.cursor.fetchone()
-				if not row or row[0] != pk:
-					return host
+			if condition is False:
+				#	Nothing would be returned.
+				return None if one else list()
+			#	Process arguments.
+			if isinstance(target, Aggregation):
+				one = True
+		
+			statement = self.create_select(
+				target, condition, count, offset, distinct, order, for_update, 
+				for_share, after
+			)
+			fetchone, fetchall = self.fetch_results(
+				statement, target, cache, for_update or for_share
+			)
+
+			#	Retrieve a loader and return it's output.
+			loader = deproxy(target).create_loader()
+			if one:
+				row, host = fetchone(), None
+				if not row:
+					return None
+			
 				pk = row[0]
-		else:
-			#	Load each model, adding to results a maximum of once.
-			loaded = OrderedDict()
-			for row in self.cursor.fetchall():
-				next_instance = loader.load_next(row, self)
-				if row[0] not in loaded:
-					loaded[row[0]] = next_instance
-			return list(loaded.values())
+				while True:
+					host = loader.load_next(row, self)
 
-	def update(self, model):
-		'''Update a single model.'''
-		if not model.__dirty__:
-			#	Nothing to commit.
-			return
+					row = fetchone()
+					if not row or row[0] != pk:
+						break
+					pk = row[0]
+
+				self.load_extensions((host,), prefetch, load)
+				return host
+			else:
+				#	Load each model, adding to results a maximum of once.
+				loaded = OrderedDict()
+				for row in fetchall():
+					next_instance = loader.load_next(row, self)
+					if row[0] not in loaded:
+						loaded[row[0]] = next_instance
+			
+				results = list(loaded.values())
+				self.load_extensions(results, prefetch, load)
+				return results
+		finally:
+			self.end_read(previous)
+
+	def fetch_results(self, statement, target, cache, locking):
+		'''
+		Execute the select `statement` or retrieve its cached rows, returning 
+		`fetchone`, `fetchall` callables over the result rows.
+		::locking Whether the statement locks rows, and so can't be cached.
+		'''
+		rows = None
+		if not locking:
+			rows = self.cached_rows(statement, target, cache)
+		if rows is None:
+			self.execute_statement(statement)
+			return self.cursor.fetchone, self.cursor.fetchall
 		
-		#	Precheck for constraint violations.
-		self.precheck_constraints(model)
+		remaining = iter(rows)
+		return lambda: next(remaining, None), lambda: list(remaining)
+
+	def load_extensions(self, models, prefetch, load):
+		'''
+		Load the relational properties named in `prefetch` and the lazy-loaded 
+		columns in `load` for `models` after a query.
+		'''
+		if load:
+			self.load_lazy(models, *load)
+		if prefetch:
+			prefetch_relations(models, *prefetch)
+
+	def page(self, target, condition=True, count=20, order=tuple(), 
+				after=None, distinct=False, prefetch=tuple(), load=tuple()):
+		'''
+		Query a page of models with keyset pagination, returning the list of 
+		models and a cursor token for the next page, or `None` if this is the
+		last page. Results are ordered by `order` followed by the primary key,
+		whose columns must be of the selected table and not null. Since the page
+		size limits rows, joins can't be paginated with this method.
+		::target The model class to query.
+		::count The page size.
+		::after The cursor token for this page, or `None` for the first.
+		The remaining parameters are equivalent to those of `query`.
+		'''
+		target_node = self.resolve_target(target)
+		if not isinstance(target_node, Table):
+			raise InvalidQuery('Only model classes can be paginated')
+		order = keyset_order(target_node, order)
+		
+		results = self.query(
+			target, condition, count=count, distinct=distinct, order=order, 
+			prefetch=prefetch, load=load, after=after
+		)
+		if len(results) < count:
+			return results, None
+		return results, encode_cursor([
+			item.column.value_on(results[-1]) for item in order
+		])
+
+	def rows(self, items, condition=True, one=False, as_dicts=False, 
+				count=None, offset=None, distinct=False, order=tuple(), 
+				for_update=False, for_share=False, group_by=tuple(), 
+				having=None, cache=None):
+		'''
+		Query the database for the values of an explicit list of columns or 
+		aggregations of a single table, returning plain tuples without loading
+		or tracking models. `query` behaves identically when passed a list
+		target.
+		::items A list of columns or aggregations, or a `Projection`.
+		::as_dicts Whether to return dictionaries keyed by column name rather
+			than tuples.
+		::group_by One or more columns by which to group rows. Each selected
+			column must be one of them.
+		::having A flag-like AST node of aggregations that groups must 
+			satisfy.
+		The remaining parameters are equivalent to those of `query`.
+		'''
+		previous = self.route_read(for_update, for_share)
+		try:
+			projection = items
+			if not isinstance(projection, Projection):
+				projection = Projection(*items)
+		
+			if group_by:
+				if not isinstance(group_by, (list, tuple)):
+					group_by = (group_by,)
+				group_by = [deproxy(column) for column in group_by]
+				for item in projection.items:
+					if isinstance(item, Aggregation):
+						continue
+					if not any(item is column for column in group_by):
+						raise InvalidQuery(
+							'Ungrouped column %s selected'%item.name
+						)
+
+			if condition is False:
+				#	Nothing would be returned.
+				return None if one else list()
+
+			statement = self.create_select(
+				projection, condition, count, offset, distinct, order, 
+				for_update, for_share, group_by=group_by, having=having
+			)
+			fetchone, fetchall = self.fetch_results(
+				statement, projection, cache, for_update or for_share
+			)
+
+			load = projection.load_dict if as_dicts else tuple
+			if one:
+				row = fetchone()
+				return load(row) if row else None
+			return [load(row) for row in fetchall()]
+		finally:
+			self.end_read(previous)
+
+	def stream(self, target, condition=True, batch_size=1000, 
+				distinct=False, order=tuple(), for_update=False, 
+				for_share=False):
+		'''
+		Query the database through a server-side cursor, returning a generator
+		that yields loaded models as they are fetched, `batch_size` rows at a
+		time. The transaction must remain open while the generator is 
+		consumed. Streamed joins are additionally ordered by the primary key 
+		of their source, so they should only be ordered by source columns. 
+		The remaining parameters are equivalent to those of `query`.
+		'''
+		if condition is False:
+			return
+
+		#	Ensure rows loading onto the same joined model are adjacent.
+		target_node = self.resolve_target(target)
+		if isinstance(target_node, Join):
+			if not isinstance(order, (list, tuple)):
+				order = (order,)
+			order = (*order, target_node.get_columns()[0].asc)
+
+		sql, values = self.create_select(
+			target, condition, None, None, distinct, order, for_update, 
+			for_share
+		).write()
+
+		#	Create a uniquely named server-side cursor.
+		Session.stream_count += 1
+		cursor = self.connection.cursor(
+			name='_cv_stream_%d'%Session.stream_count
+		)
+		cursor.itersize = batch_size
+		try:
+			self.execute(sql + ';', values, cursor)
+
+			#	Load each row, yielding models once all of their rows have
+			#	been loaded.
+			loader = deproxy(target).create_loader()
+			pending, pending_key = None, _sentinel
+			while True:
+				rows = cursor.fetchmany(batch_size)
+				if not rows:
+					break
+				
+				for row in rows:
+					next_instance = loader.load_next(row, self)
+					if row[0] != pending_key:
+						if pending_key is not _sentinel:
+							yield pending
+						pending, pending_key = next_instance, row[0]
+			
+			if pending_key is not _sentinel:
+				yield pending
+		finally:
+			cursor.close()
+
+	def dirty_columns(self, model):
+		'''Return the dirty columns of `model` in table order.'''
+		return model.__dirty_columns__()
+
+	def create_update(self, model, columns=None):
+		'''
+		Return an `UpdateStatement` for the dirty columns of `model`.
+		::columns The dirty columns of `model`, if already known.
+		'''
 		table = model.__table__
+		if columns is None:
+			columns = self.dirty_columns(model)
 
 		#	Collect assignments.
 		assignments = list()
-		for column_name in model.__dirty__:
-			column = table.columns[column_name]
+		for column in columns:
 			assignments.append((column, column.value_on(model)))
 		
 		#	Create condition.
 		condition = table.primary_key == table.primary_key.value_on(model)
-		#	Execute the update.
-		self.execute_statement(
-			UpdateStatement(table, assignments, condition)
-		)
+		return UpdateStatement(table, assignments, condition)
+
+	def update(self, model):
+		'''Update a single model.'''
+		if not model.__dirty__:
+			#	Nothing to commit.
+			return
+		
+		columns = self.dirty_columns(model)
+		if columns:
+			#	Precheck for constraint violations.
+			self.precheck_constraints(model)
+			self.wrote(model.__table__)
 
-		#	Inform model.
+			#	Execute the update.
+			self.execute_statement(self.create_update(model, columns))
+
+		#	Inform model and release it.
 		model.__loaded__(self)
+		self.loaded_models.mark_clean(model)
+
+	def update_all(self, models):
+		'''
+		Update each dirty model in `models`. Models of the same table with the
+		same dirty columns are updated together with a single statement per
+		batch; the remainder are sent several statements per round trip.
+		'''
+		policy = bulk_config()
+
+		#	Group dirty models by table and dirty column set. Touched models 
+		#	without changes are only marked clean.
+		groups, flushed = OrderedDict(), list()
+		for model in models:
+			if not model.__dirty__:
+				continue
+
+			flushed.append(model)
+			columns = self.dirty_columns(model)
+			if not columns:
+				continue
+			
+			key = (model.__table__.name, *(column.name for column in columns))
+			groups.setdefault(key, (columns, list()))[1].append(model)
+		
+		#	Precheck for constraint violations.
+		self.precheck_constraints(*(
+			model for columns, group in groups.values() for model in group
+		))
+		if groups:
+			self.wrote(*set(
+				group[0].__table__ for columns, group in groups.values()
+			))
+
+		singles = list()
+		for columns, group in groups.values():
+			if len(group) == 1:
+				singles.append(self.create_update(group[0], columns))
+				continue
+
+			table = group[0].__table__
+			batch_size = policy['batch_size']
+			for i in range(0, len(group), batch_size):
+				self.execute_statement(BulkUpdateStatement(table, columns, [
+					[
+						table.primary_key.value_on(model), 
+						*(column.value_on(model) for column in columns)
+					] for model in group[i:i + batch_size]
+				]))
+
+		if len(singles) == 1:
+			self.execute_statement(singles[0])
+		else:
+			#	Pipeline the ungroupable updates.
+			pipeline_size = policy['pipeline_size']
+			for i in range(0, len(singles), pipeline_size):
+				sqls, values = list(), list()
+				for statement in singles[i:i + pipeline_size]:
+					sql, statement_values = statement.write()
+					sqls.append(sql + ';')
+					values.extend(statement_values)
+				self.execute(' '.join(sqls), values)
+
+		#	Inform models and release them.
+		for model in flushed:
+			model.__loaded__(self)
+			self.loaded_models.mark_clean(model)
+		return self
+
+	def flush(self):
+		'''Issue the updates that occurred to all loaded models.'''
+		return self.update_all(self.loaded_models.dirty_models())
 
 	def commit(self, model=None):
 		'''
@@ -341,14 +1133,29 @@ class Session:
 		'''
 		if model is None:
 			#	Update all models.
-			for model in list(self.loaded_models.values()):
-				self.update(model)
+			self.flush()
 		else:
 			#	Update the specified model.
 			self.update(model)
 		
-		#	Commit the transaction.
+		invalidation = self.written_tables and invalidation_config()
+		if invalidation and invalidation['enabled'] and \
+				invalidation['mode'] == 'listen':
+			#	Announce the written tables to other processes as part of the
+			#	transaction.
+			emit_invalidations(self, self.written_tables)
+
+		#	Commit the transaction, then invalidate results cached while it was
+		#	open.
 		self.connection.commit()
+		self.writing = False
+		if invalidation and invalidation['enabled'] and \
+				invalidation['mode'] == 'poll':
+			#	Bump versions after the commit, to hold their rows briefly.
+			emit_invalidations(self, self.written_tables)
+		if self.written_tables:
+			get_result_cache().bump(*self.written_tables)
+			self.written_tables.clear()
 		return self
 
 	def rollback(self, reset_loaded=True):
@@ -358,14 +1165,16 @@ class Session:
 		'''
 		if reset_loaded:
 			#	Reset loaded models.
-			for model in self.loaded_models.values():
-				for attribute, clean_value in model.__dirty__.items():
-					model[attribute] = clean_value
+			for model in self.loaded_models.dirty_models():
+				model.__revert__()
 				model.__loaded__(self)
+				self.loaded_models.mark_clean(model)
 
 		#	If a connection exists, roll it back.
 		if self._connection:
 			self._connection.rollback()
+		self.writing = False
+		self.written_tables.clear()
 		return self
 	
 	def reset(self):
@@ -373,17 +1182,29 @@ class Session:
 		Rollback the current transaction and un-map all loaded models.
 		'''
 		self.rollback()
-		self.loaded_models = dict()
+		self.loaded_models.clear()
 
 		return self
 
 	def close(self):
 		'''
-		Close the active database connection. This occurs automatically in the
+		Release the active database connection back to the pool, rolling back
+		any uncommitted transaction. This occurs automatically in the 
 		destructor.
 		'''
-		if self._connection:
-			self._connection.close()
+		if self._pooled:
+			if self._cursor and not self._cursor.closed:
+				self._cursor.close()
+			#	Check the connection back in.
+			self._pooled.release()
+			self._pooled = self._connection = self._cursor = None
+		if self._replica_pooled:
+			if self._replica_cursor and not self._replica_cursor.closed:
+				self._replica_cursor.close()
+			self._replica_pooled.release()
+			self._replica_pooled = self._replica_cursor = None
+		self.writing = False
+		self.written_tables.clear()
 
 		return self
 
@@ -398,6 +1219,10 @@ class Session:
 	def __del__(self):
 		self.close()
 
-def create_session():
-	'''A stable session creation interface.'''
-	return Session()
+def create_session(**kwargs):
+	'''
+	A stable session creation interface. Keyword arguments are passed to the
+	`Session` constructor.
+	'''
+	ensure_listener()
+	return Session(**kwargs)
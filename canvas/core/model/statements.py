@@ -3,15 +3,97 @@
 Top-level statement objects.
 '''
 
-from .ast import deproxy, nodeify
+from threading import Lock
+from collections import OrderedDict
+
+from .ast import Literal, deproxy, nodeify
 from .joins import Join
+from . import _sentinel
+
+class StatementCache:
+	'''
+	A bounded, least-recently-used cache of compiled SQL keyed by statement 
+	shape. Since only bound values differ between statements of the same
+	shape, a hit costs a walk of the AST to collect values rather than a 
+	full serialization.
+	'''
+
+	def __init__(self, max_size=1024):
+		'''::max_size The maximum number of compiled statements to retain.'''
+		self.max_size = max_size
+		self.entries = OrderedDict()
+		self.hits = self.misses = 0
+		self.lock = Lock()
+
+	def get(self, key):
+		'''Return the SQL cached for `key` or `None`, counting the outcome.'''
+		with self.lock:
+			sql = self.entries.get(key)
+			if sql is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+				self.entries.move_to_end(key)
+			return sql
+
+	def put(self, key, sql):
+		'''Cache `sql` for `key`, evicting the least recently used entry.'''
+		with self.lock:
+			self.entries[key] = sql
+			if len(self.entries) > self.max_size:
+				self.entries.popitem(last=False)
+
+	def stats(self):
+		'''Return a dictionary containing hit, miss, and size counters.'''
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'size': len(self.entries)
+		}
+
+	def clear(self):
+		'''Empty this cache and reset its counters.'''
+		with self.lock:
+			self.entries.clear()
+			self.hits = self.misses = 0
+
+#	The process-wide compiled statement cache.
+statement_cache = StatementCache()
 
 #	TODO: Constructor docs.
 
 class Statement:
 	'''The top-level AST node type, which must facilitate value collection.'''
+	#	Whether the compiled SQL of this statement type can be promoted to a
+	#	server-side prepared statement.
+	preparable = False
 
 	def write(self):
+		'''
+		Return an SQL, value list tuple of this statement's serialization,
+		re-using previously compiled SQL for statements of the same shape.
+		'''
+		values = list()
+		key = self.shape(values)
+		if key is not None:
+			sql = statement_cache.get(key)
+			if sql is not None:
+				return sql, values
+		
+		sql, values = self.compile()
+		if key is not None:
+			statement_cache.put(key, sql)
+		return sql, values
+
+	def shape(self, values):
+		'''
+		Return a hashable key identifying the SQL this statement compiles to,
+		appending values exactly as `compile` would, or `None` if this 
+		statement can't be cached.
+		'''
+		return None
+
+	def compile(self):
 		'''Return an SQL, value list tuple of this statement's serialization'''
 		raise NotImplementedError()
 
@@ -21,23 +103,38 @@ class CreateStatement(Statement):
 	def __init__(self, target):
 		self.target = deproxy(target)
 
-	def write(self):
+	def compile(self):
+		values = list()
 		return ' '.join((
 			'CREATE', self.target.object_type, 'IF NOT EXISTS',
-				self.target.describe()
-		)), tuple()
+				self.target.describe(values)
+		)), values
 
 class SelectStatement(Statement):
 	'''An SQL `SELECT` statement.'''
+	preparable = True
 
 	def __init__(self, target, condition=True, modifiers=tuple(), distinct=False):
 		self.target, self.condition = deproxy(target), nodeify(condition)
 		self.modifiers = modifiers
 		self.distinct = distinct
 
-	def write(self):
-		name_policy = self.target.name_column if isinstance(self.target, Join) else None
+	def shape(self, values):
+		parts = (
+			self.target.shape(values), 
+			self.condition.shape(values),
+			*(modifier.shape(values) for modifier in self.modifiers)
+		)
+		if None in parts:
+			return None
+		return ('select', self.distinct, *parts)
+
+	def compile(self):
 		values = list()
+		if isinstance(self.target, Join) and self.target.is_flat:
+			return self.compile_flat(values), values
+
+		name_policy = self.target.name_column if isinstance(self.target, Join) else None
 
 		selection = '*'
 		if not isinstance(self.target, Join):
@@ -50,37 +147,193 @@ class SelectStatement(Statement):
 		))
 		return sql, values
 
+	def compile_flat(self, values):
+		'''
+		Return the SQL of this statement for a flattened join target, which
+		selects from a single list of `JOIN`s with the join condition and 
+		statement condition combined.
+		'''
+		name_policy = self.target.flat_name_column
+
+		conditions = list()
+		if self.target.condition is not True:
+			conditions.append(self.target.condition)
+		conditions.append(nodeify(self.condition))
+		conditions = [
+			condition.serialize(values, name_policy=name_policy)
+				for condition in conditions
+		]
+		return ' '.join((
+			'SELECT', self.target.serialize_flat_selection(),
+			'FROM', self.target.serialize_flat_source(),
+			'WHERE', ' AND '.join(
+				'(%s)'%condition for condition in conditions
+			) if len(conditions) > 1 else conditions[0],
+			*(modifier.serialize(values) for modifier in self.modifiers)
+		))
+
+def serialize_conflict(conflict, update):
+	'''
+	Return a tuple containing the SQL of an `ON CONFLICT` clause for an 
+	insert, or an empty tuple if `conflict` is `None`.
+	::conflict The list of columns of the unique index to infer, or `None`.
+	::update The list of columns to assign from the conflicting row. If empty,
+		a no-op assignment is made so the existing row is still returned.
+	'''
+	if conflict is None:
+		return tuple()
+	if not update:
+		update = conflict[:1]
+	return (' '.join((
+		'ON CONFLICT (', ', '.join(column.name for column in conflict), 
+		') DO UPDATE SET', ', '.join(
+			'%s = EXCLUDED.%s'%(column.name, column.name) for column in update
+		)
+	)),)
+
 class InsertStatement(Statement):
 	'''An SQL `INSERT` statement.'''
+	preparable = True
 
-	def __init__(self, target, values):
+	def __init__(self, target, values, conflict=None, update=tuple()):
 		'''
 		::target The target object reference.
 		::values A list of value, object-reference-esq tuples.
+		::conflict The list of columns on which a conflicting row is updated
+			rather than raising a violation, or `None`.
+		::update The list of columns to update on conflict.
 		'''
 		self.target = deproxy(target)
 		self.values = [(nodeify(value[0]), value[1]) for value in values]
+		self.conflict, self.update = conflict, update
 
-	def write(self):
+	def shape(self, values):
+		parts = tuple(
+			(id(value[1]), value[0].shape(values)) for value in self.values
+		)
+		for part in parts:
+			if part[1] is None:
+				return None
+		return ('insert', id(self.target), parts, *(
+			(
+				tuple(id(column) for column in self.conflict),
+				tuple(id(column) for column in self.update)
+			) if self.conflict is not None else tuple()
+		))
+
+	def compile(self):
 		values = list()
 		sql = ' '.join((
 			'INSERT INTO', self.target.serialize(values), '(', 
 				', '.join(value[1].name for value in self.values), 
 			') VALUES (', 
 				', '.join(value[0].serialize(values) for value in self.values), 
-			') RETURNING ', self.target.primary_key.serialize()
+			')', *serialize_conflict(self.conflict, self.update),
+			'RETURNING', self.target.primary_key.serialize()
+		))
+		return sql, values
+
+class BulkInsertStatement(Statement):
+	'''
+	A multi-row SQL `INSERT` statement. Bulk statements vary too much in shape
+	to be worth caching or preparing.
+	'''
+
+	def __init__(self, target, columns, rows, conflict=None, update=tuple()):
+		'''
+		::target The target object reference.
+		::columns The list of columns being inserted.
+		::rows A list of value lists ordered as `columns`. The sentinel value 
+			causes the in-database default to be used.
+		::conflict The list of columns on which a conflicting row is updated
+			rather than raising a violation, or `None`.
+		::update The list of columns to update on conflict.
+		'''
+		self.target, self.columns = deproxy(target), columns
+		self.rows = [
+			[
+				Literal('DEFAULT') if value is _sentinel else nodeify(value)
+					for value in row
+			] for row in rows
+		]
+		self.conflict, self.update = conflict, update
+
+	def compile(self):
+		values = list()
+		sql = ' '.join((
+			'INSERT INTO', self.target.serialize(values), '(',
+				', '.join(column.name for column in self.columns),
+			') VALUES', ', '.join(
+				'(%s)'%', '.join(value.serialize(values) for value in row)
+					for row in self.rows
+			), *serialize_conflict(self.conflict, self.update),
+			'RETURNING', self.target.primary_key.serialize()
+		))
+		return sql, values
+
+class BulkUpdateStatement(Statement):
+	'''
+	An SQL `UPDATE` statement that assigns per-row values to several rows at 
+	once by joining a `VALUES` list on the primary key. Like bulk inserts,
+	these aren't cached or prepared.
+	'''
+
+	def __init__(self, target, columns, rows):
+		'''
+		::target The target table.
+		::columns The list of columns being assigned.
+		::rows A list of value lists, each containing the primary key value of
+			the row followed by values ordered as `columns`.
+		'''
+		self.target, self.columns = deproxy(target), columns
+		self.rows = [[nodeify(value) for value in row] for row in rows]
+
+	def compile(self):
+		values = list()
+		primary_key = self.target.primary_key
+		all_columns = (primary_key, *self.columns)
+
+		#	Cast the first row so the types of the VALUES list are resolved
+		#	from the target columns rather than the literals.
+		def serialize_row(row, cast):
+			return '(%s)'%', '.join(
+				'CAST(%s AS %s)'%(
+					value.serialize(values), column.type.cast_type()
+				) if cast else value.serialize(values)
+					for column, value in zip(all_columns, row)
+			)
+		
+		sql = ' '.join((
+			'UPDATE', self.target.serialize(),
+			'SET', ', '.join(
+				'%s = _v.%s'%(column.name, column.name) 
+					for column in self.columns
+			),
+			'FROM ( VALUES', ', '.join(
+				serialize_row(row, i == 0) for i, row in enumerate(self.rows)
+			), ') AS _v (', 
+				', '.join(column.name for column in all_columns), 
+			')',
+			'WHERE', primary_key.serialize(), '=', '_v.%s'%primary_key.name
 		))
 		return sql, values
 
 class DeleteStatement(Statement):
 	'''An SQL 'DELETE FROM' statement.'''
+	preparable = True
 
 	def __init__(self, host, condition, cascade):
 		self.host, self.condition = deproxy(host), condition
 		self.cascade = cascade
 
+	def shape(self, values):
+		condition = self.condition.shape(values)
+		if condition is None:
+			return None
+		return ('delete', id(self.host), condition)
+
 	#	TODO: Handle cascade options.
-	def write(self):
+	def compile(self):
 		values = list()
 		sql = ' '.join((
 			'DELETE FROM', self.host.serialize(values),
@@ -90,14 +343,28 @@ class DeleteStatement(Statement):
 
 class UpdateStatement(Statement):
 	'''An SQL 'UPDATE' statement.'''
+	preparable = True
 
 	def __init__(self, target, assignments, condition):
 		self.target, self.condition = deproxy(target), nodeify(condition)
-		self.assignments = (
+		self.assignments = tuple(
 			(deproxy(target), nodeify(value)) for target, value in assignments
 		)
 
-	def write(self):
+	def shape(self, values):
+		parts = tuple(
+			(id(target), value.shape(values)) 
+				for target, value in self.assignments
+		)
+		for part in parts:
+			if part[1] is None:
+				return None
+		condition = self.condition.shape(values)
+		if condition is None:
+			return None
+		return ('update', id(self.target), parts, condition)
+
+	def compile(self):
 		values, assignment_expressions = list(), list()
 		for target, value in self.assignments:
 			assignment_expressions.append(
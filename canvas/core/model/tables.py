@@ -7,7 +7,9 @@ from collections import OrderedDict
 
 from ...exceptions import InvalidSchema
 from .ast import ObjectReference, IJoinable
-from .constraints import Constraint, PrimaryKeyConstraint
+from .constraints import Constraint, PrimaryKeyConstraint, \
+	UniquenessConstraint
+from .indexes import Index
 
 class Table(ObjectReference, IJoinable):
 	'''
@@ -23,12 +25,17 @@ class Table(ObjectReference, IJoinable):
 		Create a new representation of a table.
 		::name The name of the table.
 		::contents The dictionary passed to the `model` decorator containing
-			the `Column`s and `Constraint`s of this table.
+			the `Column`s, `Constraint`s, and `Index`es of this table.
 		'''
 		super().__init__('TABLE')
 		self.name = name
 		self.constraints, self.columns = list(), OrderedDict()
+		self.indexes = list()
 		self.model_cls = None
+		#	Whether queries of this table cache their results by default.
+		self.cache_results = False
+		#	The `ValidationPlan` of this table, compiled on first use.
+		self.validation_plan = None
 
 		#	Unpack the schema dictionary and locate the primary key.
 		self.primary_key = None
@@ -36,6 +43,11 @@ class Table(ObjectReference, IJoinable):
 			if isinstance(item, Constraint):
 				item.name = '_'.join((self.name, name))
 				self.constraints.append(item)
+			elif isinstance(item, Index):
+				if not item.name:
+					item.name = '_'.join((self.name, name))
+				item.bind(self)
+				self.indexes.append(item)
 			else:
 				item.name = name
 				for constraint in item.constraints:
@@ -50,6 +62,12 @@ class Table(ObjectReference, IJoinable):
 		#	Ensure the primary key is the first entry within the column map.
 		#	This invariant supports the Session class's functionality.
 		self.columns.move_to_end(self.primary_key.name, False)
+		#	Cache the non-lazy columns, which are loaded with each row, and
+		#	their names.
+		self.eager_columns = [
+			column for column in self.columns.values() if not column.type.lazy
+		]
+		self.eager_names = tuple(column.name for column in self.eager_columns)
 
 		#	Add this table to the master list.
 		Table.instances.append(self)
@@ -128,15 +146,38 @@ class Table(ObjectReference, IJoinable):
 		for name, column in self.columns.items():
 			setattr(model_cls, name, column)
 
+	def foreign_key_indexes(self):
+		'''
+		Return a list of new `Index`es for the foreign key columns of this 
+		table that aren't already the first column of an index.
+		'''
+		from .columns import ForeignKeyColumnType
+
+		indexes = list()
+		for column in self.columns.values():
+			if not isinstance(column.type, ForeignKeyColumnType):
+				continue
+			
+			#	Primary keys and unique columns are implicitly indexed.
+			indexed = column is self.primary_key or any(
+				isinstance(constraint, UniquenessConstraint) 
+					for constraint in column.constraints
+			) or any(index.is_leading(column) for index in self.indexes)
+			if not indexed:
+				index = Index(column.name, name='_'.join((
+					self.name, column.name, 'fkidx'
+				)))
+				index.bind(self)
+				indexes.append(index)
+		return indexes
+
 	def load_next(self, row_segment, session):
 		'''Return the direct result of the session load method.'''
 		return session.load_model_instance(self.model_cls, row_segment)
 
 	def get_columns(self):
 		'''Return all non-lazy constituent columns.'''
-		return [
-			column for column in self.columns.values() if not column.type.lazy
-		]
+		return self.eager_columns
 
 	def name_column(self, column):
 		'''Trivially name a column.'''
@@ -146,6 +187,10 @@ class Table(ObjectReference, IJoinable):
 		'''Return a reference to this table.'''
 		return self.name
 
+	def shape(self, values):
+		'''Key this table by identity; tables live as long as the schema.'''
+		return ('table', id(self))
+
 	def serialize_source(self, values=None):
 		'''Return a reference to this table.'''
 		return self.name
@@ -163,7 +208,7 @@ class Table(ObjectReference, IJoinable):
 			))) for column in self.get_columns())
 		)
 
-	def describe(self):
+	def describe(self, values=None):
 		'''Return the serialized description of this table.'''
 		contents = (*self.columns.values(), *self.constraints)
 		return ''.join((
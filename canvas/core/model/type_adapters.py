@@ -7,7 +7,7 @@ import uuid
 
 from datetime import datetime
 from psycopg2.extensions import adapt, register_adapter, new_type, \
-		register_type
+		register_type, adapters, ISQLQuote
 
 from ...json_io import serialize_json, deserialize_json
 
@@ -18,6 +18,18 @@ _adapted_types = [int, float, str, bytes, datetime]
 JSON_OID = 114
 UUID_OID = 2950
 
+#	Retain the native list adapter, since lists are adapted as JSON.
+_array_adapter = adapters[(list, ISQLQuote)]
+
+class ArrayParameter:
+	'''A list of values to be adapted as a Postgres array rather than JSON.'''
+
+	def __init__(self, values):
+		'''::values The list of values.'''
+		self.values = values
+
+register_adapter(ArrayParameter, lambda param: _array_adapter(param.values))
+
 class TypeAdapter:
 	'''
 	The base type adapter class, implicitly extended with the `type_adapter` decorator.
@@ -0,0 +1,99 @@
+# coding: utf-8
+'''
+Batch constraint prechecking. Each table's prechecked constraints are compiled
+once into a `ValidationPlan`, which checks a column of values for a whole
+batch of models at a time rather than each constraint of each model in turn.
+'''
+
+from ...exceptions import ValidationErrors
+from . import _sentinel
+
+class ValidationPlan:
+	'''
+	The prechecked constraints of a table, in check order. Column constraints
+	are checked before table constraints, and only the first violated
+	constraint of each column is reported.
+	'''
+
+	def __init__(self, table):
+		'''::table The `Table` to validate models of.'''
+		self.table = table
+		#	The prechecked constraints of each column that has any.
+		self.column_checks = list()
+		for column in table.columns.values():
+			constraints = [
+				constraint for constraint in column.constraints
+					if constraint.prechecks()
+			]
+			if constraints:
+				self.column_checks.append((column.name, constraints))
+		self.table_checks = [
+			constraint for constraint in table.constraints
+				if constraint.prechecks()
+		]
+
+	@classmethod
+	def get(cls, table):
+		'''Return the validation plan for `table`, compiling it if required.'''
+		plan = table.validation_plan
+		if plan is None:
+			plan = table.validation_plan = cls(table)
+		return plan
+
+	def validate(self, models):
+		'''
+		Precheck the constraints of `models` for violations. Return a
+		dictionary mapping the index of each violating model to a
+		`ValidationErrors` describing its violations.
+		'''
+		errors, summaries = dict(), dict()
+
+		for name, constraints in self.column_checks:
+			#	Collect the indices and values of the models for which this
+			#	column is loaded and initialized.
+			indices, values = list(), list()
+			for i, model in enumerate(models):
+				value = model.__value__(name, _sentinel)
+				if value is not _sentinel:
+					indices.append(i)
+					values.append(value)
+
+			#	Check each constraint against the values that haven't violated
+			#	a previous one.
+			for constraint in constraints:
+				if not values:
+					break
+				flags = constraint.precheck_violations(
+					[models[i] for i in indices], values
+				)
+
+				remaining_indices, remaining_values = list(), list()
+				for i, value, violated in zip(indices, values, flags):
+					if violated:
+						errors.setdefault(i, dict())[name] = \
+								constraint.error_message
+					else:
+						remaining_indices.append(i)
+						remaining_values.append(value)
+				indices, values = remaining_indices, remaining_values
+
+		#	Check table constraints, for which the value is the model itself.
+		remaining = list(range(len(models)))
+		for constraint in self.table_checks:
+			if not remaining:
+				break
+			checked = [models[i] for i in remaining]
+			flags = constraint.precheck_violations(checked, checked)
+
+			remaining_indices = list()
+			for i, violated in zip(remaining, flags):
+				if violated:
+					summaries[i] = constraint.error_message
+				else:
+					remaining_indices.append(i)
+			remaining = remaining_indices
+
+		return {
+			i: ValidationErrors(errors.get(i, dict()), summaries.get(i))
+				for i in sorted((*errors, *summaries))
+		}
@@ -27,6 +27,10 @@ class InvalidQuery(Exception):
 	'''Raised when a database query is recognized as invalid.'''
 	pass
 
+class PoolExhausted(Exception):
+	'''Raised when no database connection becomes available in time.'''
+	pass
+
 class InvalidTag(Exception):
 	'''Raised when an invalid `Tag` is created.'''
 	pass